@@ -1,18 +1,333 @@
+import importlib.util
+import os
+import socket
 import sys
+import threading
+import time
+import weakref
+from collections import deque
 import cv2
 import requests
+from requests.adapters import HTTPAdapter
 import numpy as np
 import json
-import io
-from PIL import Image
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                             QPushButton, QLabel, QFileDialog, QListWidget, QListWidgetItem,
                             QFrame, QSplitter, QSizePolicy, QGroupBox, QProgressBar, QScrollArea)
-from PyQt5.QtGui import QPixmap, QImage, QFont, QIcon, QPalette, QColor, QCursor
-from PyQt5.QtCore import Qt, QTimer, pyqtSlot, QSize, QPropertyAnimation, QEasingCurve
+from PyQt5.QtGui import QPixmap, QImage, QFont, QIcon, QPalette, QColor, QCursor, QPainter
+from PyQt5.QtCore import (Qt, QTimer, pyqtSlot, pyqtSignal, QObject, QThread, QSize, QPropertyAnimation,
+                          QEasingCurve)
 
+# 类别表等公共定义放在 resnet50/plantvillage 包中（labels 不依赖 torch）
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "resnet50"))
+from plantvillage.labels import IMAGEFOLDER_LIST, PLANT_LIST
+
+# 识别后端：remote 只用 HTTP 服务，local 只用进程内的本地模型，auto 优先服务器、连不上时自动改用本地模型
+BACKEND = "auto"
 # 设置Flask API的URL
 API_URL = "http://127.0.0.1:5000/predict"
+# 本地模型文件（export_model.py 导出的部署格式），默认取 resnet50 目录下训练得到的模型
+LOCAL_MODEL_PATH = os.environ.get("PV_MODEL_PATH") or os.path.join(BASE_DIR, "resnet50", "best_resnet50.pth")
+# 每次识别返回的候选病害数量
+TOP_K = 3
+# 请求超时（秒）：（建立连接, 等待响应）
+REQUEST_TIMEOUT = (3, 30)
+# 上传前在客户端缩放到服务端的输入尺寸（与 plantvillage.preprocess.INPUT_SIZE 一致，直接拉伸、不裁剪），
+# 服务端反正会丢掉其余像素；JPEG 质量越低上传越小，慢速网络下可以适当调低
+UPLOAD_SIZE = 224
+UPLOAD_JPEG_QUALITY = 90
+
+# 实时识别：同时在途的请求数上限、送检帧率上限、概率平滑系数（越小越平滑）
+LIVE_MAX_IN_FLIGHT = 2
+LIVE_MAX_FPS = 10
+LIVE_EMA_ALPHA = 0.3
+
+# 预览：读不到帧率时（部分摄像头）按 DEFAULT_FPS 采集；画面刷新率单独封顶，与采集/送检互不影响
+DEFAULT_FPS = 30
+PREVIEW_MAX_FPS = 30
+
+def resize_frame(frame, width, height, dst=None):
+    """把画面缩放到 width x height，dst 为可复用的输出数组
+
+    先用 INTER_AREA 按整数倍逐次减半（区域平均，不会出现锯齿，且走 OpenCV 的快速路径），
+    剩下不到 2 倍的缩放用双线性完成；1080p/4K 画面比一次 INTER_AREA 缩放到位快数倍，结果几乎相同。
+    """
+    while frame.shape[1] >= 2 * width and frame.shape[0] >= 2 * height:
+        frame = cv2.resize(frame, (frame.shape[1] // 2, frame.shape[0] // 2), interpolation=cv2.INTER_AREA)
+    if frame.shape[:2] == (height, width):
+        return frame
+    return cv2.resize(frame, (width, height), dst=dst, interpolation=cv2.INTER_LINEAR)
+
+
+def encode_frame(frame, size=UPLOAD_SIZE, quality=UPLOAD_JPEG_QUALITY):
+    """把 OpenCV 的 BGR 画面缩放到 size x size 后编码为 JPEG 字节
+
+    与服务端预处理一样直接拉伸到正方形，服务端收到后无需再缩放；
+    cv2.imencode 直接接受 BGR 数据，不需要颜色转换和 PIL 中转。
+    """
+    h, w = frame.shape[:2]
+    # 比输入尺寸还小的图片原样上传，放大只会增加上传字节，服务端会自行缩放
+    if w > size or h > size:
+        frame = resize_frame(frame, size, size)
+    ok, data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("图像编码失败")
+    return data.tobytes()
+
+
+class AbortableAdapter(HTTPAdapter):
+    """记录连接池建立的 socket，abort() 可从其他线程关闭它们，阻塞在等待响应上的请求立即出错返回"""
+
+    def __init__(self, *args, **kwargs):
+        self.sockets = weakref.WeakSet()
+        self.lock = threading.Lock()
+        self.aborted = False  # abort() 之后才建立的连接也立即关闭，直到下一个请求开始
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        def tracked(connection_cls):
+            class TrackedConnection(connection_cls):
+                def connect(self):
+                    super().connect()
+                    with adapter.lock:
+                        adapter.sockets.add(self.sock)
+                        aborted = adapter.aborted
+                    if aborted:
+                        self.sock.shutdown(socket.SHUT_RDWR)
+            return TrackedConnection
+
+        # 连接池类按协议替换为记录 socket 的子类（只影响本适配器，不修改 urllib3 的全局表）
+        pool_classes = {}
+        for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items():
+            pool_classes[scheme] = type(pool_cls.__name__, (pool_cls,),
+                                        {"ConnectionCls": tracked(pool_cls.ConnectionCls)})
+        self.poolmanager.pool_classes_by_scheme = pool_classes
+
+    def begin(self):
+        with self.lock:
+            self.aborted = False
+
+    def abort(self):
+        with self.lock:
+            self.aborted = True
+            sockets = list(self.sockets)
+            self.sockets.clear()
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class RemoteBackend:
+    """通过 HTTP 调用识别服务（flask_api / fast_api）
+
+    复用同一个 requests.Session，保持长连接，不必每次请求都重新握手。
+    """
+
+    def __init__(self, url=API_URL):
+        self.url = url
+        self.session = None
+        self.adapter = None
+
+    def get_session(self):
+        # 在后台线程中第一次使用时才创建
+        if self.session is None:
+            self.adapter = AbortableAdapter()
+            self.session = requests.Session()
+            self.session.mount("http://", self.adapter)
+            self.session.mount("https://", self.adapter)
+        return self.session
+
+    def begin(self):
+        """每个请求开始前调用，清除上一次 abort() 的状态"""
+        self.get_session()
+        self.adapter.begin()
+
+    def abort(self):
+        """中断正在进行的请求（可从其他线程调用）：关闭底层 socket，请求以连接错误结束，不必等到超时"""
+        if self.adapter is not None:
+            self.adapter.abort()
+
+    def check(self):
+        """检查Flask服务器是否可用"""
+        try:
+            response = self.get_session().get(self.url.replace("/predict", ""), timeout=3)
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def predict(self, frame, top_k=TOP_K):
+        # 准备要发送的文件数据
+        files = {'file': ('image.jpg', encode_frame(frame), 'image/jpeg')}
+        response = self.get_session().post(self.url, files=files, params={"top_k": top_k},
+                                           timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            raise RuntimeError(f"服务器返回状态码 {response.status_code}")
+        result = response.json()
+        # 旧版服务端只返回 top-1，没有 predictions 字段
+        return result.get('predictions') or [result]
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+
+class LocalBackend:
+    """进程内推理：加载导出的模型文件，画面缩放后直接转成张量，不经过 JPEG 编码和网络，离线可用
+
+    torch 在第一次本地识别时才导入，只使用远程服务时启动速度不受影响；
+    同一个模型文件在进程内只加载一次，各个后台线程共用。
+    """
+
+    def __init__(self, model_path=LOCAL_MODEL_PATH):
+        self.model_path = model_path
+
+    @staticmethod
+    def is_available(model_path=LOCAL_MODEL_PATH):
+        return os.path.isfile(model_path) and importlib.util.find_spec("torch") is not None
+
+    def load(self):
+        """加载并预热模型；切换到本地后端时提前在后台调用，第一次识别不必等待加载"""
+        from plantvillage.predictor import get_predictor
+        return get_predictor(self.model_path).load()
+
+    def predict(self, frame, top_k=TOP_K):
+        import torch
+        from plantvillage.preprocess import INPUT_SIZE
+
+        predictor = self.load()
+        # 与服务端一样直接拉伸到 224x224；uint8 张量由 predict_tensors 归一化
+        rgb = cv2.cvtColor(resize_frame(frame, INPUT_SIZE, INPUT_SIZE), cv2.COLOR_BGR2RGB)
+        tensor = torch.from_numpy(rgb).permute(2, 0, 1).unsqueeze(0)
+        return predictor.predict_tensors(tensor, top_k)[0]['predictions']
+
+    def begin(self):
+        pass
+
+    def abort(self):
+        # 一次前向推理很快，不中断，等它结束后丢弃结果
+        pass
+
+    def close(self):
+        pass
+
+
+class PredictionWorker(QObject):
+    """在后台线程中执行识别请求，结果通过信号交回界面线程，界面在等待期间保持流畅
+
+    每个请求指定使用的后端（remote / local），界面线程根据服务器状态选择。
+    """
+    submitted = pyqtSignal(int, object, str)  # 界面线程发出，在本线程中执行 predict
+    check_requested = pyqtSignal()
+    warmup_requested = pyqtSignal()
+    finished = pyqtSignal(int, list)  # 请求编号, 识别结果（按置信度排序的候选列表）
+    failed = pyqtSignal(int, str)  # 请求编号, 错误信息
+    cancelled = pyqtSignal(int)  # 请求编号；每个请求最终只会发出 finished/failed/cancelled 之一
+    server_checked = pyqtSignal(bool)
+
+    def __init__(self):
+        super().__init__()
+        self.backends = {"remote": RemoteBackend(), "local": LocalBackend()}
+        self.cancelled_up_to = 0  # 编号不大于该值的请求都已取消
+        self.cancelled_ids = set()  # 单独取消的请求（例如关闭实时识别时只取消实时识别的请求）
+        self.current = None  # 正在执行的 (请求编号, 后端名称)
+        self.submitted.connect(self.predict)
+        self.check_requested.connect(self.check_server)
+        self.warmup_requested.connect(self.warm_up)
+
+    def cancel(self, request_id):
+        """取消编号不大于 request_id 的请求（可从界面线程调用）：还没发送的直接跳过，
+        正在等待服务器响应的立即中断连接"""
+        self.cancelled_up_to = max(self.cancelled_up_to, request_id)
+        current = self.current
+        if current is not None and current[0] <= request_id:
+            self.backends[current[1]].abort()
+
+    def cancel_request(self, request_id):
+        """只取消指定编号的一个请求（可从界面线程调用）"""
+        self.cancelled_ids.add(request_id)
+        current = self.current
+        if current is not None and current[0] == request_id:
+            self.backends[current[1]].abort()
+
+    def is_cancelled(self, request_id):
+        return request_id <= self.cancelled_up_to or request_id in self.cancelled_ids
+
+    @pyqtSlot()
+    def check_server(self):
+        self.server_checked.emit(self.backends["remote"].check())
+
+    @pyqtSlot()
+    def warm_up(self):
+        try:
+            self.backends["local"].load()
+        except Exception:
+            # 加载失败时不在这里报错，识别时会把错误信息显示出来
+            pass
+
+    @pyqtSlot(int, object, str)
+    def predict(self, request_id, frame, backend):
+        if self.is_cancelled(request_id):
+            self.cancelled.emit(request_id)
+            return
+        self.backends[backend].begin()
+        self.current = (request_id, backend)
+        try:
+            # 设置 current 与 cancel 之间存在竞争：取消恰好发生在两者之间时，这里再检查一次
+            if self.is_cancelled(request_id):
+                raise RuntimeError("请求已取消")
+            predictions = self.backends[backend].predict(frame)
+            if self.is_cancelled(request_id):
+                self.cancelled.emit(request_id)
+                return
+            self.finished.emit(request_id, predictions)
+        except Exception as e:
+            if self.is_cancelled(request_id):
+                self.cancelled.emit(request_id)
+            else:
+                self.failed.emit(request_id, str(e))
+        finally:
+            self.current = None
+            self.cancelled_ids.discard(request_id)
+
+    def close(self):
+        for backend in self.backends.values():
+            backend.close()
+
+
+class LiveSmoother:
+    """实时识别结果的平滑：对各类别概率做指数滑动平均，避免标签在相邻帧之间来回跳动"""
+
+    def __init__(self, alpha=LIVE_EMA_ALPHA):
+        self.alpha = alpha
+        self.probabilities = {}
+        self.latest_id = 0
+
+    def reset(self):
+        self.probabilities = {}
+        self.latest_id = 0
+
+    def update(self, request_id, predictions):
+        """合并一次识别结果；比已合并结果更旧的（乱序返回的）直接丢弃"""
+        if request_id <= self.latest_id:
+            return False
+        self.latest_id = request_id
+        current = {p.get('class_name'): p.get('confidence') or 0.0 for p in predictions}
+        for name in set(self.probabilities) | set(current):
+            previous = self.probabilities.get(name, 0.0)
+            self.probabilities[name] = previous + self.alpha * (current.get(name, 0.0) - previous)
+        # 长期不出现的类别衰减到很小后移除
+        self.probabilities = {name: p for name, p in self.probabilities.items() if p > 1e-3}
+        return True
+
+    def top(self, k=TOP_K):
+        return sorted(self.probabilities.items(), key=lambda item: item[1], reverse=True)[:k]
+
 
 class PlantIdentificationApp(QMainWindow):
     def __init__(self):
@@ -106,37 +421,56 @@ class PlantIdentificationApp(QMainWindow):
         self.camera_active = False  # 摄像头状态
         self.timer = QTimer()  # 定时器，用于更新摄像头画面
         self.timer.timeout.connect(self.update_camera_frame)  # 连接定时器信号到更新函数
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.playback_file = False  # 视频文件按时间戳播放，摄像头按到帧即读
+        self.frame_interval = 1.0 / DEFAULT_FPS
+        self.playback_start = 0.0
+        self.frames_read = 0
+        self.next_render = 0.0
+        self.preview_buffer = None  # 复用的 RGB 预览缓冲区，尺寸不变时不重新分配
+        
+        # 病害类别列表与类别映射
+        self.plant_list = PLANT_LIST
+        self.imagefolder_list = IMAGEFOLDER_LIST
         
-        # 病害类别列表
-        self.plant_list = ["苹果黑星病","苹果黑腐病","苹果桧胶锈病","苹果健康叶","蓝莓健康叶","樱桃白粉病","樱桃健康叶",
-                          "玉米灰斑病","玉米普通锈病","玉米叶枯病","玉米健康叶","葡萄黑腐病","葡萄黑痘病","葡萄叶枯病",
-                          "葡萄健康叶","柑橘黄龙病","桃细菌性穿孔病","桃树健康叶","甜椒细菌性叶斑病","甜椒健康叶","土豆早疫病",
-                          "土豆晚疫病","土豆健康叶","树莓健康叶","大豆健康叶","南瓜白粉病","草莓炭疽病","草莓健康叶",
-                          "番茄细菌性斑疹病","番茄早疫病","番茄晚疫病","番茄叶霉病","番茄灰叶斑病","番茄二斑叶螨",
-                          "番茄斑点病","番茄叶黄病毒病","番茄花叶病毒病","番茄健康叶"]
+        # 后台请求线程：识别请求和服务器检查都不在界面线程中执行，
+        # 每个线程同一时间只处理一个请求，实时识别时最多 LIVE_MAX_IN_FLIGHT 个请求同时在途
+        self.request_id = 0  # 最近一次手动识别请求的编号，旧请求的结果直接丢弃
+        self.next_request_id = 0
+        self.in_flight = {}  # 请求编号 -> (处理它的 worker, 发出时间, 是否实时识别)
+        self.request_threads = []
+        self.workers = []
+        for _ in range(LIVE_MAX_IN_FLIGHT):
+            thread = QThread(self)
+            worker = PredictionWorker()
+            worker.moveToThread(thread)
+            worker.finished.connect(self.on_prediction)
+            worker.failed.connect(self.on_prediction_failed)
+            worker.cancelled.connect(self.on_prediction_cancelled)
+            worker.server_checked.connect(self.on_server_checked)
+            thread.start()
+            self.request_threads.append(thread)
+            self.workers.append(worker)
         
-        # 类别映射
-        self.imagefolder_list = {0: 0, 1: 1, 2: 10, 3: 11, 4: 12, 5: 13, 6: 14, 7: 15, 8: 16, 9: 17,
-                                10: 18, 11: 19, 12: 2, 13: 20, 14: 21, 15: 22, 16: 23, 17: 24, 18: 25,
-                                19: 26, 20: 27, 21: 28, 22: 29, 23: 3, 24: 30, 25: 31, 26: 32, 27: 33,
-                                28: 34, 29: 35, 30: 36, 31: 37, 32: 4, 33: 5, 34: 6, 35: 7, 36: 8, 37: 9}
+        # 实时识别状态：自适应送检间隔、概率平滑、帧率和延迟统计
+        self.live_mode = False
+        self.live_smoother = LiveSmoother()
+        self.live_latency = None  # 请求延迟的滑动平均（秒）
+        self.live_last_submit = 0.0
+        self.live_result_times = deque(maxlen=30)
+        self.live_label = None  # 当前显示详细信息的类别，变化时才刷新
+        self.overlay_text = None
         
-        # 检查服务器连接状态
-        self.server_available = self.check_server()
+        # 服务器连接状态在后台检查，结果返回前视为不可用，不阻塞启动
+        self.server_available = False
+        # 当前使用的识别后端（remote / local），没有可用后端时为 None
+        self.backend = None
+        self.local_available = BACKEND != "remote" and LocalBackend.is_available()
         
         # 初始化UI界面 - 放在最后
         self.init_ui()
         
-    def check_server(self):
-        """检查Flask服务器是否可用"""
-        try:
-            response = requests.get(API_URL.replace("/predict", ""), timeout=3)
-            if response.status_code == 200:
-                return True
-            return False
-        except:
-            return False
-        
+
     def init_ui(self):
         """初始化用户界面"""
         # 创建中央部件和主布局
@@ -286,6 +620,29 @@ class PlantIdentificationApp(QMainWindow):
         
         left_layout.addWidget(self.btn_identify)
         
+        # 实时识别按钮：摄像头/视频画面连续送检
+        self.btn_live = QPushButton("实时识别")
+        self.btn_live.setCheckable(True)
+        self.btn_live.setCursor(QCursor(Qt.PointingHandCursor))
+        self.btn_live.setEnabled(False)
+        self.btn_live.setMinimumHeight(50)
+        self.btn_live.setStyleSheet("""
+            QPushButton {
+                background-color: #9C27B0;
+            }
+            QPushButton:hover {
+                background-color: #7B1FA2;
+            }
+            QPushButton:checked {
+                background-color: #f44336;
+            }
+            QPushButton:disabled {
+                background-color: #cccccc;
+            }
+        """)
+        self.btn_live.toggled.connect(self.set_live_mode)
+        left_layout.addWidget(self.btn_live)
+        
         # 右侧面板 - 结果显示区域
         right_panel = QWidget()
         right_layout = QVBoxLayout(right_panel)
@@ -376,17 +733,33 @@ class PlantIdentificationApp(QMainWindow):
         self.update_server_status()
     
     def update_server_status(self):
-        """更新服务器状态显示"""
-        if hasattr(self, 'status_label') and hasattr(self, 'btn_identify'):
-            if self.check_server():
-                self.server_available = True
-                self.status_label.setText("准备就绪，服务器连接正常")
-                self.btn_identify.setEnabled(self.current_image is not None)
-            else:
-                self.server_available = False
-                self.status_label.setText("警告：无法连接到识别服务器！请确保Flask服务正在运行")
-                self.status_label.setStyleSheet("color: #d32f2f; font-weight: bold; font-size: 14px;")
-                self.btn_identify.setEnabled(False)
+        """在后台检查服务器状态，结果由 on_server_checked 更新到界面"""
+        self.workers[0].check_requested.emit()
+    
+    def on_server_checked(self, available):
+        """更新服务器状态显示，并选择识别后端：服务器可用时走 HTTP，否则退回本地模型"""
+        self.server_available = available
+        if available and BACKEND != "local":
+            self.backend = "remote"
+            message = "准备就绪，服务器连接正常"
+        elif self.local_available:
+            if self.backend != "local":
+                self.workers[0].warmup_requested.emit()
+            self.backend = "local"
+            message = "准备就绪，使用本地模型识别" if BACKEND == "local" else "未连接到服务器，已切换为本地模型识别"
+        else:
+            self.backend = None
+        if self.backend:
+            self.status_label.setText(message)
+            self.status_label.setStyleSheet("color: #555; font-style: italic; font-size: 14px;")
+            self.btn_identify.setEnabled(self.current_image is not None)
+            self.btn_live.setEnabled(self.camera_active)
+        else:
+            self.status_label.setText("警告：无法连接到识别服务器！请确保Flask服务正在运行")
+            self.status_label.setStyleSheet("color: #d32f2f; font-weight: bold; font-size: 14px;")
+            self.btn_identify.setEnabled(False)
+            self.btn_live.setChecked(False)
+            self.btn_live.setEnabled(False)
     
     def select_image(self):
         """选择图片文件并显示"""
@@ -398,17 +771,19 @@ class PlantIdentificationApp(QMainWindow):
             # 如果摄像头正在运行，先停止
             if self.camera_active:
                 self.toggle_camera()
+            # 换了图像，之前的识别结果已无意义
+            self.cancel_prediction()
                 
             # 加载并显示图片
             self.current_image = cv2.imread(file_path)
             self.display_image(self.current_image)
             self.status_label.setText(f"已加载图片: {file_path.split('/')[-1]}")
             
-            # 只有当服务器可用时才启用识别按钮
-            self.btn_identify.setEnabled(self.server_available)
+            # 只有当有可用的识别后端（服务器或本地模型）时才启用识别按钮
+            self.btn_identify.setEnabled(self.backend is not None)
             
             # 如果服务器不可用，更新状态
-            if not self.server_available:
+            if self.backend is None:
                 self.update_server_status()
             
             # 更新图片标签样式
@@ -429,15 +804,17 @@ class PlantIdentificationApp(QMainWindow):
             # 如果摄像头正在运行，先停止
             if self.camera_active:
                 self.toggle_camera()
+            self.cancel_prediction()
                 
             # 打开视频文件
             self.video_capture = cv2.VideoCapture(file_path)
             if self.video_capture.isOpened():
-                self.timer.start(30)  # 每30ms更新一次
+                self.start_playback(is_file=True)
                 self.camera_active = True
                 self.btn_camera.setText("停止视频")
                 self.status_label.setText(f"已加载视频: {file_path.split('/')[-1]}")
                 self.btn_identify.setEnabled(True)
+                self.btn_live.setEnabled(self.backend is not None)
                 
                 # 更新按钮样式
                 self.btn_select_video.setStyleSheet("""
@@ -456,6 +833,9 @@ class PlantIdentificationApp(QMainWindow):
         """切换摄像头状态（开启/关闭）"""
         if self.camera_active:
             # 停止摄像头
+            self.btn_live.setChecked(False)
+            self.btn_live.setEnabled(False)
+            self.cancel_prediction()
             self.timer.stop()
             if self.video_capture:
                 self.video_capture.release()
@@ -478,16 +858,17 @@ class PlantIdentificationApp(QMainWindow):
             # 启动摄像头
             self.video_capture = cv2.VideoCapture(0)
             if self.video_capture.isOpened():
-                self.timer.start(30)  # 每30ms更新一次
+                self.start_playback(is_file=False)
                 self.camera_active = True
                 self.btn_camera.setText("停止摄像头")
                 self.status_label.setText("摄像头已启动 - 可以开始识别")
                 
-                # 只有当服务器可用时才启用识别按钮
-                self.btn_identify.setEnabled(self.server_available)
+                # 只有当有可用的识别后端（服务器或本地模型）时才启用识别按钮
+                self.btn_identify.setEnabled(self.backend is not None)
+                self.btn_live.setEnabled(self.backend is not None)
                 
                 # 如果服务器不可用，更新状态
-                if not self.server_available:
+                if self.backend is None:
                     self.update_server_status()
                 
                 # 更新按钮样式
@@ -502,15 +883,60 @@ class PlantIdentificationApp(QMainWindow):
             else:
                 self.status_label.setText("错误：无法访问摄像头")
     
+    def start_playback(self, is_file):
+        """按视频源自身的帧率驱动画面更新"""
+        fps = self.video_capture.get(cv2.CAP_PROP_FPS)
+        if not 0 < fps <= 240:
+            fps = DEFAULT_FPS
+        self.playback_file = is_file
+        self.frame_interval = 1.0 / fps
+        self.playback_start = time.perf_counter()
+        self.frames_read = 0
+        self.next_render = 0.0
+        # 视频文件按时间戳取帧，定时器取半帧间隔，保证每一帧都能按时显示；
+        # 摄像头的 read() 会等到下一帧就绪，按帧间隔轮询即可
+        interval = self.frame_interval / 2 if is_file else self.frame_interval
+        self.timer.start(max(1, int(interval * 1000)))
+    
+    def read_due_frame(self):
+        """视频文件：按播放时间算出此刻应显示的帧，还没到时间返回 (True, None)；
+        解码跟不上时用 grab() 跳过落后的帧（不做颜色转换和拷贝），播放速度与原视频一致"""
+        due = int((time.perf_counter() - self.playback_start) / self.frame_interval) + 1
+        if due <= self.frames_read:
+            return True, None
+        while self.frames_read < due - 1:
+            if not self.video_capture.grab():
+                return False, None
+            self.frames_read += 1
+        self.frames_read += 1
+        return self.video_capture.read()
+    
     def update_camera_frame(self):
         """更新摄像头画面"""
         if self.video_capture and self.video_capture.isOpened():
-            ret, frame = self.video_capture.read()
+            if self.playback_file:
+                ret, frame = self.read_due_frame()
+                if ret and frame is None:
+                    return
+            else:
+                ret, frame = self.video_capture.read()
             if ret:
                 self.current_image = frame
-                self.display_image(frame)
+                if self.live_mode:
+                    self.submit_live_frame(frame)
+                # 刷新率封顶：高帧率视频源照常采集和送检，只是不逐帧重绘。
+                # 按截止时间而不是与上次重绘的间隔判断，帧到达时间的抖动不会让同帧率的视频源隔帧丢弃
+                now = time.perf_counter()
+                if now >= self.next_render:
+                    self.next_render += 1.0 / PREVIEW_MAX_FPS
+                    if self.next_render < now:
+                        # 落后超过一个间隔（例如刚开始播放或界面卡顿）时从当前时刻重新计时，不补画
+                        self.next_render = now
+                    self.display_image(frame)
             else:
                 # 视频文件结束
+                self.btn_live.setChecked(False)
+                self.btn_live.setEnabled(False)
                 self.timer.stop()
                 self.video_capture.release()
                 self.video_capture = None
@@ -536,103 +962,218 @@ class PlantIdentificationApp(QMainWindow):
         if cv_img is None:
             return
             
-        # 转换为RGB格式
-        cv_img = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-        
-        # 计算新尺寸，保持宽高比
-        h, w, c = cv_img.shape
+        # 计算新尺寸，保持宽高比，不放大
+        h, w = cv_img.shape[:2]
         label_width = self.image_label.width() - 20  # 考虑内边距
         label_height = self.image_label.height() - 20
+        scale = min(label_width / w, label_height / h, 1.0)
+        new_width = max(1, int(w * scale))
+        new_height = max(1, int(h * scale))
         
-        if w > h:
-            new_width = min(label_width, w)
-            new_height = int(h * (new_width / w))
-        else:
-            new_height = min(label_height, h)
-            new_width = int(w * (new_height / h))
+        # 先在原图上缩放到显示尺寸，再在小图上转换为RGB，4K 画面也只处理显示所需的像素
+        if self.preview_buffer is None or self.preview_buffer.shape[:2] != (new_height, new_width):
+            self.preview_buffer = np.empty((new_height, new_width, 3), dtype=np.uint8)
+        small = resize_frame(cv_img, new_width, new_height, dst=self.preview_buffer)
+        cv2.cvtColor(small, cv2.COLOR_BGR2RGB, dst=self.preview_buffer)
         
-        # 转换为QImage，然后转换为QPixmap
-        bytes_per_line = c * w
-        q_img = QImage(cv_img.data, w, h, bytes_per_line, QImage.Format_RGB888)
+        # 转换为QImage（直接引用缓冲区，不拷贝），然后转换为QPixmap
+        q_img = QImage(self.preview_buffer.data, new_width, new_height, 3 * new_width, QImage.Format_RGB888)
         pixmap = QPixmap.fromImage(q_img)
-        
-        # 缩放图像并设置到标签
-        pixmap = pixmap.scaled(new_width, new_height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        if self.live_mode and self.overlay_text:
+            self.draw_overlay(pixmap, self.overlay_text)
         self.image_label.setPixmap(pixmap)
     
+    def draw_overlay(self, pixmap, text):
+        """在画面顶部叠加实时识别结果（cv2.putText 不支持中文，用 QPainter 绘制）"""
+        painter = QPainter(pixmap)
+        font = painter.font()
+        font.setPointSize(12)
+        font.setBold(True)
+        painter.setFont(font)
+        height = painter.fontMetrics().height() + 10
+        painter.fillRect(0, 0, pixmap.width(), height, QColor(0, 0, 0, 160))
+        painter.setPen(QColor(255, 255, 255))
+        painter.drawText(8, 0, pixmap.width() - 16, height, Qt.AlignVCenter | Qt.AlignLeft, text)
+        painter.end()
+    
     def identify_plant(self):
-        """开始植物病害识别"""
+        """开始植物病害识别：把当前画面交给后台线程，界面不等待服务器响应"""
         if self.current_image is None:
             self.status_label.setText("错误：没有图像可识别")
             return
             
-        # 检查服务器是否可用
-        if not self.server_available:
+        # 检查是否有可用的识别后端
+        if self.backend is None:
             self.update_server_status()
-            if not self.server_available:
-                self.status_label.setText("错误：无法连接到识别服务器！请确保Flask服务正在运行")
-                return
+            self.status_label.setText("错误：无法连接到识别服务器！请确保Flask服务正在运行")
+            return
+        
+        # 新请求发出后，之前还没返回的请求一律作废
+        self.cancel_prediction()
         
         # 清除之前的结果
         self.results_list.clear()
         self.disease_info.setText("处理中...")
         
         # 显示进度条
-        self.progress_bar.setValue(0)
+        self.progress_bar.setValue(30)
         self.progress_bar.show()
         
         # 更新状态
-        self.status_label.setText("正在分析图像中的植物病害...")
+        self.status_label.setText("正在发送图像到服务器..." if self.backend == "remote" else "正在使用本地模型识别...")
         
-        try:
-            # 将OpenCV图像转换为PIL图像
-            cv_img = cv2.cvtColor(self.current_image, cv2.COLOR_BGR2RGB)
-            pil_img = Image.fromarray(cv_img)
-            
-            # 创建一个内存文件对象保存图像
-            img_byte_arr = io.BytesIO()
-            pil_img.save(img_byte_arr, format='JPEG')
-            img_byte_arr.seek(0)
-            
-            # 更新进度条
-            self.progress_bar.setValue(30)
-            
-            # 准备要发送的文件数据
-            files = {'file': ('image.jpg', img_byte_arr, 'image/jpeg')}
-            
-            # 发送请求到Flask API
-            self.status_label.setText("正在发送图像到服务器...")
-            response = requests.post(API_URL, files=files)
-            
-            # 更新进度条
-            self.progress_bar.setValue(70)
-            
-            if response.status_code == 200:
-                # 解析返回的JSON结果
-                result = response.json()
-                disease_name = result.get('class_name')
-                confidence = result.get('confidence')
-                
-                # 获取病害信息
-                info = self.get_disease_info(disease_name)
-                
-                # 构建结果数据
-                results = [{
-                    "disease": disease_name,
-                    "confidence": confidence,
-                    "info": info
-                }]
-                
-                # 显示结果
-                self.show_results(results)
-                self.status_label.setText("识别完成")
-            else:
-                self.status_label.setText(f"错误：服务器返回状态码 {response.status_code}")
-                self.progress_bar.hide()
-                
-        except Exception as e:
-            self.status_label.setText(f"错误：识别过程中发生错误 - {str(e)}")
-            self.progress_bar.hide()
+        self.request_id = self.submit_frame(self.current_image)
+    
+    def idle_worker(self):
+        busy = {worker for worker, _, _ in self.in_flight.values()}
+        for worker in self.workers:
+            if worker not in busy:
+                return worker
+        return None
+    
+    def submit_frame(self, frame, live=False):
+        """把一帧交给空闲的后台线程，返回请求编号；实时识别时没有空闲线程就丢弃该帧，返回 None"""
+        worker = self.idle_worker()
+        if worker is None:
+            if live:
+                return None
+            worker = self.workers[0]  # 手动识别排在当前请求之后
+        self.next_request_id += 1
+        request_id = self.next_request_id
+        self.in_flight[request_id] = (worker, time.perf_counter(), live)
+        # 拷贝当前帧，摄像头/视频继续刷新画面不影响正在识别的图像
+        worker.submitted.emit(request_id, frame.copy(), self.backend)
+        return request_id
+    
+    def finish_request(self, request_id):
+        """请求结束（成功、失败或取消），返回 (发出时间, 是否实时识别)"""
+        _, sent_at, live = self.in_flight.pop(request_id, (None, None, False))
+        return sent_at, live
+    
+    def cancel_prediction(self):
+        """取消正在进行的识别请求"""
+        for worker in self.workers:
+            worker.cancel(self.request_id)
+        self.progress_bar.hide()
+    
+    def on_prediction_cancelled(self, request_id):
+        self.finish_request(request_id)
+    
+    def on_prediction(self, request_id, predictions):
+        """后台线程返回的识别结果"""
+        sent_at, live = self.finish_request(request_id)
+        if live:
+            self.on_live_prediction(request_id, predictions, sent_at)
+            return
+        if request_id != self.request_id:
+            return
+        
+        # 构建结果数据，按置信度从高到低列出候选病害
+        results = [{
+            "disease": prediction.get('class_name'),
+            "confidence": prediction.get('confidence'),
+            "info": self.get_disease_info(prediction.get('class_name'))
+        } for prediction in predictions]
+        
+        # 显示结果
+        self.show_results(results)
+    
+    def on_prediction_failed(self, request_id, message):
+        _, live = self.finish_request(request_id)
+        if self.backend == "remote" and self.local_available:
+            # 服务器中途断开时重新检查，连不上就切换到本地模型
+            self.update_server_status()
+        if live:
+            # 出错时放大送检间隔，服务器异常期间不持续发送请求
+            self.live_latency = min(5.0, (self.live_latency or 0.5) * 2)
+            self.status_label.setText(f"实时识别出错 - {message}")
+            return
+        if request_id != self.request_id:
+            return
+        self.status_label.setText(f"错误：识别过程中发生错误 - {message}")
+        self.disease_info.setText("从列表中选择病害查看详细信息")
+        self.progress_bar.hide()
+    
+    def set_live_mode(self, enabled):
+        """开启/关闭实时识别：摄像头或视频的画面按服务器吞吐自适应地连续送检"""
+        self.live_mode = enabled
+        self.live_smoother.reset()
+        self.live_latency = None
+        self.live_result_times.clear()
+        self.live_label = None
+        if enabled:
+            self.btn_live.setText("停止实时识别")
+            self.status_label.setText("实时识别中...")
+        else:
+            self.btn_live.setText("实时识别")
+            self.overlay_text = None
+            # 丢弃还没返回的实时识别请求，正在进行的手动识别不受影响
+            for request_id, (worker, _, live) in self.in_flight.items():
+                if live:
+                    worker.cancel_request(request_id)
+    
+    def submit_live_frame(self, frame):
+        """送检间隔不小于 平均延迟/在途上限（与服务器吞吐匹配），且不超过 LIVE_MAX_FPS；
+        所有线程都在等待响应时直接丢弃该帧，不排队，始终识别最新的画面"""
+        interval = 1.0 / LIVE_MAX_FPS
+        if self.live_latency is not None:
+            interval = max(interval, self.live_latency / LIVE_MAX_IN_FLIGHT)
+        now = time.perf_counter()
+        if now - self.live_last_submit < interval:
+            return
+        if self.submit_frame(frame, live=True) is not None:
+            self.live_last_submit = now
+    
+    def on_live_prediction(self, request_id, predictions, sent_at):
+        now = time.perf_counter()
+        latency = now - sent_at
+        self.live_latency = latency if self.live_latency is None else 0.8 * self.live_latency + 0.2 * latency
+        self.live_result_times.append(now)
+        # 关闭实时识别后才返回的结果，或比已显示结果更旧的结果，不再更新界面
+        if not self.live_mode or not self.live_smoother.update(request_id, predictions):
+            return
+        top = self.live_smoother.top()
+        if not top:
+            return
+        name, probability = top[0]
+        self.overlay_text = (f"{name} {probability * 100:.0f}%  |  {self.live_fps():.1f} FPS  |  "
+                             f"{self.live_latency * 1000:.0f} ms")
+        self.update_live_results(top)
+    
+    def live_fps(self):
+        """最近若干个结果的实际识别帧率"""
+        if len(self.live_result_times) < 2:
+            return 0.0
+        span = self.live_result_times[-1] - self.live_result_times[0]
+        return (len(self.live_result_times) - 1) / span if span > 0 else 0.0
+    
+    def update_live_results(self, top):
+        """用平滑后的概率刷新结果列表；首选病害变化时才刷新详细信息"""
+        self.results_list.clear()
+        for name, probability in top:
+            self.results_list.addItem(self.make_result_item(name, probability, self.get_disease_info(name)))
+        if top[0][0] != self.live_label:
+            self.live_label = top[0][0]
+            self.results_list.setCurrentRow(0)
+            self.show_disease_info(self.results_list.item(0))
+    
+    def closeEvent(self, event):
+        """关闭窗口时停止摄像头和后台请求线程"""
+        self.timer.stop()
+        if self.video_capture:
+            self.video_capture.release()
+        self.live_mode = False
+        for worker in self.workers:
+            worker.cancel(self.next_request_id)
+        # 进行中的请求已被中断，后台线程结束当前任务后退出；必须等线程完全结束，
+        # 再在界面线程中关闭连接（此时没有线程在使用它们）
+        for thread in self.request_threads:
+            thread.quit()
+        for thread in self.request_threads:
+            thread.wait()
+        for worker in self.workers:
+            worker.close()
+        super().closeEvent(event)
     
     def get_disease_info(self, disease_name):
         """获取病害的详细信息"""
@@ -685,24 +1226,7 @@ class PlantIdentificationApp(QMainWindow):
         QTimer.singleShot(500, lambda: self.progress_bar.hide())
         
         for result in results:
-            disease = result["disease"]
-            confidence = result["confidence"]
-            
-            item = QListWidgetItem(f"{disease}: {confidence*100:.1f}%")
-            item.setData(Qt.UserRole, result["info"])
-            
-            # 根据置信度设置背景颜色
-            if confidence > 0.7:
-                item.setBackground(QColor(200, 255, 200))  # 浅绿色
-                item.setForeground(QColor(0, 100, 0))      # 深绿色文字
-            elif confidence > 0.4:
-                item.setBackground(QColor(255, 255, 200))  # 浅黄色
-                item.setForeground(QColor(128, 128, 0))    # 橄榄色文字
-            else:
-                item.setBackground(QColor(255, 230, 230))  # 浅红色
-                item.setForeground(QColor(128, 0, 0))      # 深红色文字
-                
-            self.results_list.addItem(item)
+            self.results_list.addItem(self.make_result_item(result["disease"], result["confidence"], result["info"]))
         
         # 连接项目选择到显示病害信息
         self.results_list.itemClicked.connect(self.show_disease_info)
@@ -714,6 +1238,22 @@ class PlantIdentificationApp(QMainWindow):
         
         self.status_label.setText("识别完成 - 点击病害查看详细信息")
     
+    def make_result_item(self, disease, confidence, info):
+        item = QListWidgetItem(f"{disease}: {confidence*100:.1f}%")
+        item.setData(Qt.UserRole, info)
+        
+        # 根据置信度设置背景颜色
+        if confidence > 0.7:
+            item.setBackground(QColor(200, 255, 200))  # 浅绿色
+            item.setForeground(QColor(0, 100, 0))      # 深绿色文字
+        elif confidence > 0.4:
+            item.setBackground(QColor(255, 255, 200))  # 浅黄色
+            item.setForeground(QColor(128, 128, 0))    # 橄榄色文字
+        else:
+            item.setBackground(QColor(255, 230, 230))  # 浅红色
+            item.setForeground(QColor(128, 0, 0))      # 深红色文字
+        return item
+    
     def show_disease_info(self, item):
         """显示病害详细信息"""
         info = item.data(Qt.UserRole)
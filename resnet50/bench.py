@@ -0,0 +1,279 @@
+# 端到端预测流水线基准：随机初始化的 ResNet50 + 合成 JPEG，无需训练好的模型和网络
+# 分别测量 解码 / 预处理 / 前向 / 后处理 各阶段，进程内端到端，以及不同并发下 flask_api 和 fast_api 的 HTTP 请求
+# 结果（p50/p95/p99 延迟、吞吐、峰值内存）输出为 JSON，方便在不同提交之间比较
+# 用法：python bench.py --out bench.json [--servers flask fast] [--concurrency 1 4 16] [--model best_resnet50.pth]
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+import torch
+from torchvision import models
+
+from bench_decode import synthetic_jpeg
+from plantvillage import config
+from plantvillage.checkpoint import export_model
+from plantvillage.labels import NUM_CLASSES
+from plantvillage.predictor import Predictor
+from plantvillage.preprocess import INPUT_SIZE, TRANSFORM, load_image, normalize, to_uint8_tensor
+from plantvillage.runtime import run_model
+
+RESOLUTIONS = [(640, 480), (1920, 1080), (4000, 3000)]
+
+# 启动各个服务的命令，工作目录为本文件所在目录（模板和静态文件使用相对路径）
+SERVERS = {
+    "flask": [sys.executable, "-c", "import sys; from flask_api import app; "
+              "app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"],
+    "fast": [sys.executable, "-m", "uvicorn", "fast_api:app", "--host", "127.0.0.1", "--log-level", "warning",
+             "--port"],
+}
+
+
+def summarize(latencies, elapsed=None):
+    """延迟（秒）列表 -> 毫秒分位数；给出总耗时时同时计算吞吐"""
+    latencies = np.asarray(latencies) * 1000
+    summary = {
+        "count": len(latencies),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+    }
+    if elapsed:
+        summary["throughput_per_s"] = round(len(latencies) / elapsed, 2)
+    return summary
+
+
+def measure(fn, repeat, warmup=2):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def peak_rss_mb(pid=None):
+    """进程的峰值常驻内存（MB）；Linux 读 /proc，其他平台只支持当前进程"""
+    if pid is not None:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            return None
+        return None
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def random_model(path):
+    """随机初始化的 ResNet50，输出类别数与真实模型一致，计算量完全相同"""
+    torch.manual_seed(0)
+    export_model(models.resnet50(num_classes=NUM_CLASSES), None, path)
+    return path
+
+
+def bench_stages(predictor, images, repeat, batch_sizes):
+    """单独测量每个阶段；解码/预处理按分辨率，前向/后处理按批大小"""
+    draft_size = INPUT_SIZE if config.FAST_DECODE else None
+    stages = {"decode": {}, "preprocess": {}, "forward": {}, "postprocess": {}}
+    for name, data in images.items():
+        stages["decode"][name] = measure(lambda: load_image(data, draft_size), repeat)
+        image = load_image(data, draft_size)
+        if config.FAST_DECODE:
+            stages["preprocess"][name] = measure(lambda: normalize(to_uint8_tensor(image).unsqueeze(0)), repeat)
+        else:
+            stages["preprocess"][name] = measure(lambda: TRANSFORM(image), repeat)
+
+    for batch_size in batch_sizes:
+        tensors = torch.randn(batch_size, 3, INPUT_SIZE, INPUT_SIZE, device=predictor.device)
+        forward = measure(lambda: run_model(predictor.model, tensors), repeat)
+        forward["images_per_s"] = round(batch_size * forward.pop("throughput_per_s"), 2)
+        stages["forward"][f"batch_{batch_size}"] = forward
+        outputs = run_model(predictor.model, tensors)
+        stages["postprocess"][f"batch_{batch_size}"] = measure(lambda: predictor.postprocess(outputs, 5), repeat)
+    return stages
+
+
+def bench_inprocess(predictor, images, repeat, batch_sizes):
+    """进程内端到端：图片字节 -> 预测结果，不经过网络"""
+    results = {}
+    for name, data in images.items():
+        results[f"predict_one_{name}"] = measure(lambda: predictor.predict_one(data), repeat)
+    data = images[next(iter(images))]
+    for batch_size in batch_sizes:
+        batch = [data] * batch_size
+        summary = measure(lambda: predictor.predict_batch(batch), max(1, repeat // batch_size))
+        summary["images_per_s"] = round(batch_size * summary.pop("throughput_per_s"), 2)
+        results[f"predict_batch_{batch_size}"] = summary
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(name, env, timeout=180):
+    port = free_port()
+    here = os.path.dirname(os.path.abspath(__file__))
+    # fast_api 挂载 static 目录，空目录不在版本库中，新克隆的仓库里需要先创建
+    os.makedirs(os.path.join(here, "static"), exist_ok=True)
+    process = subprocess.Popen(SERVERS[name] + [str(port)], cwd=here, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} 服务启动失败（退出码 {process.returncode}）")
+        try:
+            if requests.get(url + "/stats", timeout=1).ok:
+                return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{name} 服务 {timeout}s 内未就绪")
+
+
+def http_load(url, payloads, concurrency, total):
+    """闭环压测：concurrency 个线程各自复用一个连接，连续发送共 total 个请求"""
+    local = threading.local()
+    counter = iter(range(total))
+    lock = threading.Lock()
+    latencies = []
+    errors = 0
+
+    def worker():
+        nonlocal errors
+        session = getattr(local, "session", None) or requests.Session()
+        local.session = session
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            name, data = payloads[index % len(payloads)]
+            begin = time.perf_counter()
+            try:
+                response = session.post(url + "/predict", files={"file": (name, data, "image/jpeg")}, timeout=60)
+                ok = response.ok and "error" not in response.json()
+            except (requests.RequestException, ValueError):
+                ok = False
+            elapsed = time.perf_counter() - begin
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    summary = summarize(latencies, time.perf_counter() - start) if latencies else {"count": 0}
+    summary["errors"] = errors
+    return summary
+
+
+def bench_http(names, model_path, payloads, concurrency_levels, requests_per_level):
+    env = dict(os.environ, PV_MODEL_PATH=model_path, PV_CACHE_SIZE="0", PV_CACHE_DB="")
+    results = {}
+    for name in names:
+        process, url = start_server(name, env)
+        try:
+            http_load(url, payloads, 1, 4)  # 预热连接和服务端的惰性初始化
+            results[name] = {
+                f"concurrency_{level}": http_load(url, payloads, level, requests_per_level)
+                for level in concurrency_levels
+            }
+            results[name]["peak_rss_mb"] = peak_rss_mb(process.pid)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端预测流水线基准")
+    parser.add_argument("--model", default=None, help="模型文件，默认使用随机初始化的 ResNet50")
+    parser.add_argument("--repeat", type=int, default=20, help="每项进程内测量的重复次数")
+    parser.add_argument("--quality", type=int, default=90, help="合成 JPEG 的压缩质量")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 16])
+    parser.add_argument("--servers", nargs="*", default=["flask", "fast"], choices=sorted(SERVERS),
+                        help="要压测的 HTTP 服务，留空则跳过")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=64, help="每个并发级别发送的请求数")
+    parser.add_argument("--http-resolution", default="640x480", help="HTTP 压测上传的图片分辨率")
+    parser.add_argument("--out", default=None, help="结果 JSON 的保存路径，默认只打印")
+    args = parser.parse_args()
+
+    images = {f"{w}x{h}": synthetic_jpeg(w, h, args.quality) for w, h in RESOLUTIONS}
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model or random_model(os.path.join(tmp, "random_resnet50.pth"))
+
+        start = time.perf_counter()
+        predictor = Predictor(model_path).load()
+        load_seconds = time.perf_counter() - start
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "torch": torch.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "device": str(predictor.device),
+                "model": args.model or "random",
+                "fast_decode": bool(config.FAST_DECODE),
+                "torch_threads": torch.get_num_threads(),
+            },
+            "model_load_s": round(load_seconds, 3),
+            "stages": bench_stages(predictor, images, args.repeat, args.batch_sizes),
+            "inprocess": bench_inprocess(predictor, images, args.repeat, args.batch_sizes),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+        if args.servers:
+            width, height = map(int, args.http_resolution.split("x"))
+            # 服务端启动时关闭了预测缓存，测到的是完整的解码 + 推理路径
+            payloads = [(f"bench_{i}.jpg", synthetic_jpeg(width, height, args.quality, seed=i)) for i in range(16)]
+            report["http"] = bench_http(args.servers, model_path, payloads, args.concurrency, args.requests)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
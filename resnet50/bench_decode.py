@@ -0,0 +1,65 @@
+# 解码/预处理基准：对比原始路径（完整解码 + torchvision 变换）与快速路径（JPEG draft 降采样 + uint8 张量）
+# 用法：python bench_decode.py [--repeat 20] [--quality 90]
+import argparse
+import io
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from plantvillage.preprocess import INPUT_SIZE, TRANSFORM, load_image, normalize, to_uint8_tensor
+
+# 常见输入分辨率：网页上传、1080p 视频帧、1200 万像素手机照片
+RESOLUTIONS = [(640, 480), (1920, 1080), (4000, 3000)]
+
+
+def synthetic_jpeg(width, height, quality, seed=0):
+    """生成带渐变和噪声的合成 JPEG，压缩难度接近真实叶片照片"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, 0.5 * (x + y), y + 0 * x], axis=2)
+    noise = rng.normal(0, 20, size=(height, width, 3))
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def baseline(data):
+    return TRANSFORM(load_image(data))
+
+
+def fast(data):
+    return normalize(to_uint8_tensor(load_image(data, INPUT_SIZE)).unsqueeze(0))[0]
+
+
+def timeit(fn, data, repeat):
+    fn(data)  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(data)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="解码/预处理基准")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--quality", type=int, default=90)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    print(f"{'分辨率':>12} {'JPEG大小':>10} {'原始路径ms':>12} {'快速路径ms':>12} {'加速比':>8} {'最大像素差':>10}")
+    for width, height in RESOLUTIONS:
+        data = synthetic_jpeg(width, height, args.quality)
+        base_ms = timeit(baseline, data, args.repeat)
+        fast_ms = timeit(fast, data, args.repeat)
+        # 在归一化空间比较两条路径的结果差异（换算回 0~255 像素值）
+        diff = (baseline(data) - fast(data)).abs() * torch.tensor(TRANSFORM.transforms[-1].std).view(3, 1, 1) * 255
+        print(f"{width}x{height:<7} {len(data) / 1024:>8.0f}KB {base_ms:>12.2f} {fast_ms:>12.2f} "
+              f"{base_ms / fast_ms:>7.1f}x {diff.max().item():>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+# 把旧版整模型文件（torch.save(model)）或训练检查点转换为部署格式：只保存 state_dict 和类别映射，推理服务内存映射加载
+# 用法：python export_model.py --src last_checkpoint.pth --out best_resnet50.pth
+import argparse
+import time
+
+from plantvillage.checkpoint import export_model, load_model_file, read_metadata
+from plantvillage.runtime import load_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出部署格式的模型文件")
+    parser.add_argument("--src", default="best_resnet50.pth", help="旧版整模型文件或训练检查点")
+    parser.add_argument("--out", default="best_resnet50.pth", help="输出路径，可与 --src 相同（原地转换）")
+    args = parser.parse_args()
+
+    model, meta = load_model_file(args.src)
+    # 旧版文件没有保存类别映射，推理时按 ImageFolder 的默认排序推导
+    digest = export_model(model, meta.get("class_to_idx"), args.out)
+    print(f"已导出 {args.out}（hash {digest}, 类别数 {read_metadata(args.out)['num_classes']}）")
+
+    start = time.perf_counter()
+    load_model(args.out)
+    print(f"加载并预热耗时 {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,57 @@
-import io
-import torch
-import torchvision.transforms as transforms
-from PIL import Image
-from fastapi import FastAPI, File, UploadFile, Request  # 添加 Request 导入
+import asyncio
+import time
+import zipfile
+from contextlib import ExitStack
+
+from fastapi import FastAPI, File, UploadFile, Request, Query  # 添加 Request 导入
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from PIL import UnidentifiedImageError
+
+from plantvillage import config, metrics
+from plantvillage.batch_io import (BatchTooLarge, aiter_ndjson, aiterate, alimit_items, error_record, is_ndjson,
+                                   is_zip, iter_zip, result_record, safe_preprocess, to_ndjson)
+from plantvillage.cache import PredictionCache
+from plantvillage.engine import BatchingEngine
+from plantvillage.executors import ExecutionLayer, Overloaded
+from plantvillage.labels import NUM_CLASSES
+from plantvillage.predictor import get_predictor
 
 app = FastAPI(title="植物病害识别系统")
 
+
+class MetricsMiddleware:
+    """按路由统计请求数、状态码和耗时；流式响应的耗时算到最后一块数据发送完"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # 路由匹配后 scope 中带有 route，用路由模板而不是原始路径，避免标签数量无限增长
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "other")
+            metrics.observe_request(endpoint, scope["method"], status, time.perf_counter() - start)
+
+
+app.add_middleware(MetricsMiddleware)
+
 # 配置 CORS
 app.add_middleware(
     CORSMiddleware,
@@ -25,48 +67,100 @@ templates = Jinja2Templates(directory="templates")
 # 配置静态文件
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# 加载模型
-model = torch.load("best_resnet50.pth")
-model.eval()
-
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
-
-# 保持原有的列表和映射不变
-plant_list = ["苹果黑星病","苹果黑腐病","苹果桧胶锈病","苹果健康叶","蓝莓健康叶","樱桃白粉病","樱桃健康叶",
-              "玉米灰斑病","玉米普通锈病","玉米叶枯病","玉米健康叶","葡萄黑腐病","葡萄黑痘病","葡萄叶枯病",
-              "葡萄健康叶","柑橘黄龙病","桃细菌性穿孔病","桃树健康叶","甜椒细菌性叶斑病","甜椒健康叶","土豆早疫病",
-              "土豆晚疫病","土豆健康叶","树莓健康叶","大豆健康叶","南瓜白粉病","草莓炭疽病","草莓健康叶",
-              "番茄细菌性斑疹病","番茄早疫病","番茄晚疫病","番茄叶霉病","番茄灰叶斑病","番茄二斑叶螨",
-              "番茄斑点病","番茄叶黄病毒病","番茄花叶病毒病","番茄健康叶"]
-
-imagefolder_list = {0: 0, 1: 1, 2: 10, 3: 11, 4: 12, 5: 13, 6: 14, 7: 15, 8: 16, 9: 17,
-                    10: 18, 11: 19, 12: 2, 13: 20, 14: 21, 15: 22, 16: 23, 17: 24, 18: 25,
-                    19: 26, 20: 27, 21: 28, 22: 29, 23: 3, 24: 30, 25: 31, 26: 32, 27: 33,
-                    28: 34, 29: 35, 30: 36, 31: 37, 32: 4, 33: 5, 34: 6, 35: 7, 36: 8, 37: 9}
-
-async def transform_image(image_bytes):
-    my_transforms = transforms.Compose([
-        transforms.Resize(224),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(
-            [0.485, 0.456, 0.406],
-            [0.229, 0.224, 0.225]
-        )
-    ])
-    image = Image.open(io.BytesIO(image_bytes))
-    return my_transforms(image).unsqueeze(0)
-
-async def get_prediction(image_bytes):
-    tensor = await transform_image(image_bytes)
-    tensor = tensor.to(device)
-    outputs = model(tensor)
-    predicted_class = torch.argmax(outputs, dim=1).item()
-    predicted_class = imagefolder_list[predicted_class]
-    confidence = torch.max(torch.softmax(outputs, dim=1)).item()
-    class_name = plant_list[predicted_class]
-    return predicted_class, class_name, confidence
+# 进程内共享的预测器：启动时加载模型、冻结参数并预热
+predictor = get_predictor().load()
+
+# 按图片内容缓存预测结果，模型文件变化时自动失效，参数见 plantvillage/config.py
+cache = PredictionCache()
+
+# 执行层：解码/预处理线程池 + 推理线程池，参数见 plantvillage/config.py
+execution = ExecutionLayer()
+
+# 动态批处理引擎，参数见 plantvillage/config.py（PV_MAX_BATCH_SIZE、PV_MAX_WAIT_MS 等环境变量）
+engine = BatchingEngine(predictor.predict_tensors, executor=execution.inference_pool,
+                        max_concurrent_batches=execution.inference_workers)
+
+# /metrics 中的缓存、队列和执行层指标在采集时直接读取这些对象的状态
+metrics.register_cache_metrics(cache)
+metrics.register_engine_metrics(engine, execution)
+
+@app.on_event("startup")
+async def start_engine():
+    await engine.start()
+
+@app.on_event("shutdown")
+async def stop_engine():
+    await engine.stop()
+    execution.shutdown()
+
+async def get_prediction(image_bytes, top_k=1):
+    # 哈希、查缓存、解码和预处理在线程池中完成，事件循环只负责调度
+    keys, cached, tensor = await execution.run_decode(cache.lookup_or_preprocess, predictor, image_bytes, top_k)
+    if cached is not None:
+        return cached
+    result = await engine.submit(tensor, top_k)
+    if keys:
+        await execution.run_decode(cache.put, keys, result)
+    return result
+
+async def predict_item(data, error, top_k, slots):
+    # 批量预测中的单张图片：解码失败只影响这一张
+    async with slots:
+        if error is None:
+            keys, cached, tensor, error = await execution.run_decode(safe_preprocess, predictor, data, cache, top_k)
+        if error is not None:
+            return None, error
+        if cached is not None:
+            return cached, None
+        result = await engine.submit(tensor, top_k)
+        if keys:
+            await execution.run_decode(cache.put, keys, result)
+        return result, None
+
+async def start_predictions(request, top_k):
+    """读取批量请求中的图片并立即提交预测任务，返回 [(文件名, 任务)]
+
+    NDJSON 请求边接收边解码推理，不等整个请求体上传完。
+    """
+    content_type = request.headers.get("content-type", "")
+    if is_ndjson(content_type):
+        # 每行一个 {"name": ..., "image": "<base64>"}
+        items = aiter_ndjson(request.stream())
+    elif is_zip(None, content_type):
+        items = aiterate(iter_zip(await request.body()))
+    else:
+        form = await request.form()
+        uploads = []
+        for upload in form.getlist("files") + form.getlist("file"):
+            data = await upload.read()
+            if is_zip(upload.filename, upload.content_type):
+                uploads.extend(iter_zip(data))
+            else:
+                uploads.append((upload.filename, data, None))
+        items = aiterate(uploads)
+    # 单个请求同时解码/推理的图片数上限，避免大批量请求一次性把所有图片解码进内存
+    slots = asyncio.Semaphore(2 * config.MAX_BATCH_SIZE)
+    tasks = []
+    try:
+        async for name, data, error in alimit_items(items):
+            tasks.append((name, asyncio.ensure_future(predict_item(data, error, top_k, slots))))
+    except BaseException:
+        for _, task in tasks:
+            task.cancel()
+        raise
+    return tasks
+
+async def stream_predictions(tasks, admission):
+    """按输入顺序逐行返回 NDJSON 结果，前面的图片一出结果就发送给客户端"""
+    try:
+        for index, (name, task) in enumerate(tasks):
+            result, error = await task
+            record = error_record(index, name, error) if error else result_record(index, name, result)
+            yield to_ndjson(record)
+    finally:
+        for _, task in tasks:
+            task.cancel()
+        admission.close()
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):  # request 参数是必需的
@@ -76,16 +170,55 @@ async def home(request: Request):  # request 参数是必需的
     )
 
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
+async def predict(file: UploadFile = File(...), top_k: int = Query(1, ge=1, le=NUM_CLASSES)):
     try:
-        img_bytes = await file.read()
-        class_id, class_name, confidence = await get_prediction(img_bytes)
+        with execution.admit():
+            with metrics.stage_timer("read"):
+                img_bytes = await file.read()
+            result = await get_prediction(img_bytes, top_k)
         return {
-            "class_name": class_name,
-            "confidence": confidence
+            "class_name": result["class_name"],
+            "confidence": result["confidence"],
+            "predictions": result["predictions"]
         }
+    except Overloaded as e:
+        return JSONResponse(status_code=503, content={"error": str(e)}, headers={"Retry-After": "1"})
+    except UnidentifiedImageError:
+        return JSONResponse(status_code=400, content={"error": "无法识别的图片格式"})
     except Exception as e:
-        return {"error": str(e)}
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request, top_k: int = Query(1, ge=1, le=NUM_CLASSES)):
+    """批量预测：支持多文件上传、zip 压缩包或 base64 图片的 NDJSON 流，结果以 NDJSON 流式返回"""
+    # 整个批量请求只占一个在途名额，在结果流结束时释放
+    admission = ExitStack()
+    try:
+        admission.enter_context(execution.admit())
+        tasks = await start_predictions(request, top_k)
+    except Overloaded as e:
+        return JSONResponse(status_code=503, content={"error": str(e)}, headers={"Retry-After": "1"})
+    except BatchTooLarge as e:
+        admission.close()
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except zipfile.BadZipFile as e:
+        admission.close()
+        return JSONResponse(status_code=400, content={"error": f"无法解析压缩包: {e}"})
+    except BaseException:
+        # 其他异常（畸形的 multipart、客户端中途断开、任务取消等）同样立即释放名额
+        admission.close()
+        raise
+    return StreamingResponse(stream_predictions(tasks, admission), media_type="application/x-ndjson")
+
+@app.get("/stats")
+async def stats():
+    # 批处理参数、当前队列深度、批大小分布、线程池和缓存状态
+    return {"engine": engine.stats(), "execution": execution.stats(), "cache": cache.stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Prometheus 文本格式：请求数、各阶段耗时、批大小、队列深度、缓存命中和内存
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,56 +1,66 @@
-import io
-import json
-import torch
-from torchvision import models
-import torchvision.transforms as transforms
-from PIL import Image
-from flask import Flask, jsonify, request, render_template
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, Response, g, jsonify, request, render_template, stream_with_context
 from flask_cors import CORS  # 导入 CORS
+from PIL import UnidentifiedImageError
+
+from plantvillage import config, metrics
+from plantvillage.batch_io import BatchTooLarge, is_ndjson, is_zip, iter_ndjson, iter_zip, predict_stream, to_ndjson
+from plantvillage.cache import PredictionCache
+from plantvillage.labels import NUM_CLASSES
+from plantvillage.predictor import get_predictor
 
 app = Flask(__name__)
 CORS(app)  # 允许所有来源的跨域请求，默认允许所有
 
-# 加载模型
-model = torch.load("best_resnet50.pth")
-model.eval()
-
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
-
-plant_list = ["苹果黑星病","苹果黑腐病","苹果桧胶锈病","苹果健康叶","蓝莓健康叶","樱桃白粉病","樱桃健康叶",
-              "玉米灰斑病","玉米普通锈病","玉米叶枯病","玉米健康叶","葡萄黑腐病","葡萄黑痘病","葡萄叶枯病",
-              "葡萄健康叶","柑橘黄龙病","桃细菌性穿孔病","桃树健康叶","甜椒细菌性叶斑病","甜椒健康叶","土豆早疫病",
-              "土豆晚疫病","土豆健康叶","树莓健康叶","大豆健康叶","南瓜白粉病","草莓炭疽病","草莓健康叶",
-              "番茄细菌性斑疹病","番茄早疫病","番茄晚疫病","番茄叶霉病","番茄灰叶斑病","番茄二斑叶螨",
-              "番茄斑点病","番茄叶黄病毒病","番茄花叶病毒病","番茄健康叶"]
-
-imagefolder_list = {0: 0, 1: 1, 2: 10, 3: 11, 4: 12, 5: 13, 6: 14, 7: 15, 8: 16, 9: 17,
-                    10: 18, 11: 19, 12: 2, 13: 20, 14: 21, 15: 22, 16: 23, 17: 24, 18: 25,
-                    19: 26, 20: 27, 21: 28, 22: 29, 23: 3, 24: 30, 25: 31, 26: 32, 27: 33,
-                    28: 34, 29: 35, 30: 36, 31: 37, 32: 4, 33: 5, 34: 6, 35: 7, 36: 8, 37: 9}
-
-def transform_image(image_bytes):
-    # 定义图像预处理方法
-    my_transforms = transforms.Compose([transforms.Resize(224),
-                                        transforms.CenterCrop(224),
-                                        transforms.ToTensor(),
-                                        transforms.Normalize(
-                                            [0.485, 0.456, 0.406],
-                                            [0.229, 0.224, 0.225])])
-    image = Image.open(io.BytesIO(image_bytes))
-    return my_transforms(image).unsqueeze(0)
-
-def get_prediction(image_bytes):
-    tensor = transform_image(image_bytes=image_bytes)
-    tensor = tensor.to(device)
-    outputs = model(tensor)
-    # 获取预测的类别及其置信度
-    predicted_class = torch.argmax(outputs, dim=1).item()
-    predicted_class = imagefolder_list[predicted_class]     #将类别映射为正值
-    confidence = torch.max(torch.softmax(outputs, dim=1)).item()
-    # 使用类别索引查找类别名称
-    class_name = plant_list[predicted_class]  # 从 plant_list 获取类别名称
-    return predicted_class, class_name, confidence
+# 进程内共享的预测器：启动时加载模型、冻结参数并预热
+predictor = get_predictor().load()
+
+# 按图片内容缓存预测结果，模型文件变化时自动失效，参数见 plantvillage/config.py
+cache = PredictionCache()
+
+# 批量预测时并行解码图片的线程池
+decode_pool = ThreadPoolExecutor(config.DECODE_WORKERS, thread_name_prefix="pv-decode")
+
+# /metrics 中的缓存指标在采集时直接读取缓存的计数器
+metrics.register_cache_metrics(cache)
+
+@app.before_request
+def start_timer():
+    g.start_time = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # 用路由模板作为标签，流式响应只统计到响应头发出为止
+    endpoint = request.url_rule.rule if request.url_rule else "other"
+    metrics.observe_request(endpoint, request.method, response.status_code, time.perf_counter() - g.start_time)
+    return response
+
+def get_prediction(image_bytes, top_k=1):
+    # 相同图片直接返回缓存结果
+    keys, cached, tensor = cache.lookup_or_preprocess(predictor, image_bytes, top_k)
+    if cached is not None:
+        return cached
+    # 推理和类别映射都由 plantvillage 包统一完成，一次 softmax+topk 得到前 k 个候选
+    result = predictor.predict_tensors(tensor.unsqueeze(0), top_k)[0]
+    cache.put(keys, result)
+    return result
+
+def get_top_k():
+    # top_k 可放在查询参数或表单字段中，默认只返回 top-1
+    # 不能用 get(type=int)：它会把 top_k=abc 静默地当作默认值 1，这里与 fast_api 一样直接拒绝
+    value = request.values.get('top_k')
+    if value is None:
+        return 1
+    try:
+        top_k = int(value)
+    except ValueError:
+        return None
+    if not 1 <= top_k <= NUM_CLASSES:
+        return None
+    return top_k
 
 # 添加根路由处理
 
@@ -65,13 +75,71 @@ def predict():
     if request.method == 'POST':
         # 获取上传的文件
         file = request.files['file']
-        img_bytes = file.read()
+        with metrics.stage_timer("read"):
+            img_bytes = file.read()
+        top_k = get_top_k()
+        if top_k is None:
+            return jsonify({"error": f"top_k 必须是 1~{NUM_CLASSES} 之间的整数"}), 400
         # 获取预测结果
-        class_id, class_name, confidence = get_prediction(image_bytes=img_bytes)
+        try:
+            result = get_prediction(image_bytes=img_bytes, top_k=top_k)
+        except UnidentifiedImageError:
+            return jsonify({"error": "无法识别的图片格式"}), 400
         return jsonify({
-            'class_name': class_name,
-            'confidence': confidence
+            'class_name': result['class_name'],
+            'confidence': result['confidence'],
+            'predictions': result['predictions']
         })
 
+def iter_uploads():
+    """把批量请求中的图片统一展开为 (文件名, 字节, 错误信息)"""
+    if is_ndjson(request.content_type):
+        # 每行一个 {"name": ..., "image": "<base64>"}，边读边处理
+        return iter_ndjson(request.stream)
+    if is_zip(None, request.content_type):
+        return iter_zip(request.get_data())
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    items = []
+    for file in uploads:
+        data = file.read()
+        if is_zip(file.filename, file.mimetype):
+            items.extend(iter_zip(data))
+        else:
+            items.append((file.filename, data, None))
+    if len(items) > config.MAX_BATCH_ITEMS:
+        raise BatchTooLarge(f"单次最多上传 {config.MAX_BATCH_ITEMS} 张图片")
+    return items
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """批量预测：支持多文件上传、zip 压缩包或 base64 图片的 NDJSON 流，结果以 NDJSON 流式返回"""
+    top_k = get_top_k()
+    if top_k is None:
+        return jsonify({"error": f"top_k 必须是 1~{NUM_CLASSES} 之间的整数"}), 400
+    try:
+        items = iter_uploads()
+    except BatchTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except zipfile.BadZipFile as e:
+        return jsonify({"error": f"无法解析压缩包: {e}"}), 400
+
+    def generate():
+        try:
+            yield from predict_stream(predictor, items, decode_pool, cache, top_k)
+        except BatchTooLarge as e:
+            yield to_ndjson({"error": str(e)})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/stats')
+def stats():
+    # 预测缓存命中情况
+    return jsonify({"cache": cache.stats()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Prometheus 文本格式：请求数、各阶段耗时、批大小、缓存命中和内存
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -1,11 +1,13 @@
 import os
 import cv2
-import shutil
-import random
+import json
+import hashlib
+import argparse
+from multiprocessing import Pool
+from collections import Counter
 from tqdm import tqdm  # 引入 tqdm 库
 
-# 设置随机种子保证可复现性
-random.seed(42)
+from plantvillage.shards import ShardWriter, write_index
 
 # 数据集路径
 img_dir = r'E:/studycode/py/12/Plant disease identification/archive/PlantVillage_for_object_detection/Dataset/images'
@@ -15,74 +17,203 @@ output_dir = r'E:/studycode/py/pythonProject/mypy_data/plantvillage_splitted'
 # 记录错误日志的文件
 error_log = "error_files.txt"
 
+# 记录已完成标签文件的清单，中断后重新运行会跳过其中的文件
+manifest_name = "manifest.jsonl"
+
 # 数据集划分比例
 train_ratio = 0.7
 val_ratio = 0.15
 test_ratio = 0.15
 
-# 数据集划分路径
-train_dir = os.path.join(output_dir, "train")
-val_dir = os.path.join(output_dir, "val")
-test_dir = os.path.join(output_dir, "test")
-
-for split_dir in [train_dir, val_dir, test_dir]:
-    os.makedirs(split_dir, exist_ok=True)
-
-# 获取所有的标签文件
-label_files = [f for f in os.listdir(label_dir) if f.endswith(".txt")]
-
-# 打开日志文件
-with open(error_log, "w") as log_file:
-    for label_file in tqdm(label_files, desc="Processing images", unit="file"):
-        img_file = os.path.join(img_dir, label_file.replace(".txt", ".jpg"))
-        img = cv2.imread(img_file)
-
-        if img is None:
-            print(f"⚠️ 警告: 无法读取图像 {img_file}")
-            log_file.write(f"无法读取图像: {img_file}\n")
-            continue
-
-        h, w, _ = img.shape
-        label_path = os.path.join(label_dir, label_file)
-
-        with open(label_path, "r") as f:
-            for line_num, line in enumerate(f.readlines(), start=1):
-                data = line.strip().split()
-
-                if len(data) < 5:
-                    print(f"🚨 错误: {label_file} 第 {line_num} 行格式错误 -> `{line.strip()}`")
-                    log_file.write(f"格式错误: {label_file} 第 {line_num} 行 `{line.strip()}`\n")
-                    continue
-
+SPLITS = ("train", "val", "test")
+
+
+def assign_split(key):
+    """按裁剪图的唯一标识做哈希划分：结果只取决于文件名和框的位置，与处理顺序、进程数无关"""
+    value = int(hashlib.md5(key.encode("utf-8")).hexdigest()[:8], 16) / 0x100000000
+    if value < train_ratio:
+        return "train"
+    elif value < train_ratio + val_ratio:
+        return "val"
+    return "test"
+
+
+def save_to_dir(output_dir):
+    """目录输出：每张裁剪图保存为 <划分>/<类别>/<文件名>.jpg"""
+    def save(split, class_id, name, crop):
+        class_dir = os.path.join(output_dir, split, class_id)
+        os.makedirs(class_dir, exist_ok=True)
+        cv2.imwrite(os.path.join(class_dir, name), crop)
+    return save
+
+
+def process_label_file(label_file, img_dir, label_dir, save):
+    """处理一个标签文件：裁剪其中所有目标框并交给 save 保存，返回裁剪记录和错误信息"""
+    crops = []
+    errors = []
+    img_file = os.path.join(img_dir, label_file.replace(".txt", ".jpg"))
+    img = cv2.imread(img_file)
+
+    if img is None:
+        errors.append(f"无法读取图像: {img_file}")
+        return {"label_file": label_file, "crops": crops, "errors": errors}
+
+    h, w, _ = img.shape
+    label_path = os.path.join(label_dir, label_file)
+
+    with open(label_path, "r") as f:
+        for line_num, line in enumerate(f.readlines(), start=1):
+            data = line.strip().split()
+
+            if len(data) < 5:
+                errors.append(f"格式错误: {label_file} 第 {line_num} 行 `{line.strip()}`")
+                continue
+
+            try:
+                class_id = data[0]
+                x_center, y_center, width, height = map(float, data[1:])
+            except ValueError as e:
+                errors.append(f"解析错误: {label_file} 第 {line_num} 行 `{line.strip()}`，错误详情：{e}")
+                continue
+
+            x1 = int((x_center - width / 2) * w)
+            y1 = int((y_center - height / 2) * h)
+            x2 = int((x_center + width / 2) * w)
+            y2 = int((y_center + height / 2) * h)
+
+            crop = img[y1:y2, x1:x2]
+            if crop.size == 0:
+                continue
+
+            name = f"{label_file.replace('.txt', '')}_{x1}_{y1}.jpg"
+            split = assign_split(name)
+            save(split, class_id, name, crop)
+            crops.append([split, class_id, name])
+
+    return {"label_file": label_file, "crops": crops, "errors": errors}
+
+
+def process_chunk(args):
+    # 子进程一次处理一块标签文件，减少进程间通信次数
+    chunk, chunk_id, img_dir, label_dir, output_dir, output_format = args
+    cv2.setNumThreads(1)  # 并行已由进程池负责，避免 OpenCV 内部再开线程抢核心
+    writers = {}
+    if output_format == "shards":
+        # 分片输出：这一块的裁剪图按划分顺序写入 <划分>-<块编号>.tar，不产生大量小文件
+        def save(split, class_id, name, crop):
+            if split not in writers:
+                writers[split] = ShardWriter(os.path.join(output_dir, f"{split}-{chunk_id:07d}.tar"))
+            ok, jpeg = cv2.imencode(".jpg", crop)
+            if not ok:
+                raise ValueError(f"无法编码裁剪图 {name}")
+            writers[split].add(name[:-len(".jpg")], jpeg.tobytes(), class_id)
+    else:
+        save = save_to_dir(output_dir)
+    results = []
+    for label_file in chunk:
+        try:
+            results.append(process_label_file(label_file, img_dir, label_dir, save))
+        except Exception as e:
+            results.append({"label_file": label_file, "crops": [], "errors": [f"处理失败: {label_file}，错误详情：{e}"]})
+    # 整块处理完才把分片改为正式文件名，随后父进程才写入清单
+    shards = {}
+    for split, writer in writers.items():
+        writer.close()
+        shards[split] = os.path.basename(writer.path)
+    if output_format == "shards":
+        # 目录模式没有分片，清单中不记录 shards
+        for record in results:
+            record["shards"] = {split: shards[split] for split in {crop[0] for crop in record["crops"]}}
+    return results
+
+
+def load_manifest(path):
+    """读取已完成的标签文件记录；最后一行可能因中断而不完整，直接忽略"""
+    done = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
                 try:
-                    class_id = data[0]
-                    x_center, y_center, width, height = map(float, data[1:])
-                except ValueError as e:
-                    print(f"🚨 解析错误: {label_file} 第 {line_num} 行 `{line.strip()}`，错误详情：{e}")
-                    log_file.write(f"解析错误: {label_file} 第 {line_num} 行 `{line.strip()}`，错误详情：{e}\n")
+                    record = json.loads(line)
+                except ValueError:
                     continue
-
-                x1 = int((x_center - width / 2) * w)
-                y1 = int((y_center - height / 2) * h)
-                x2 = int((x_center + width / 2) * w)
-                y2 = int((y_center + height / 2) * h)
-
-                crop = img[y1:y2, x1:x2]
-                if crop.size == 0:
-                    continue
-
-                # 计算数据集划分
-                rand_num = random.random()
-                if rand_num < train_ratio:
-                    split_dir = train_dir
-                elif rand_num < train_ratio + val_ratio:
-                    split_dir = val_dir
-                else:
-                    split_dir = test_dir
-
-                class_dir = os.path.join(split_dir, class_id)
-                os.makedirs(class_dir, exist_ok=True)
-                save_path = os.path.join(class_dir, f"{label_file.replace('.txt', '')}_{x1}_{y1}.jpg")
-                cv2.imwrite(save_path, crop)
-
-print("✅ 数据集转换并划分完成！")
+                done[record["label_file"]] = record
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把 YOLO 标注的检测数据集裁剪为分类数据集，并划分 train/val/test")
+    parser.add_argument("--img-dir", default=img_dir)
+    parser.add_argument("--label-dir", default=label_dir)
+    parser.add_argument("--output-dir", default=output_dir)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="进程数")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="每次分发给子进程的标签文件数（分片模式下即每个分片对应的标签文件数）")
+    parser.add_argument("--format", choices=["dirs", "shards"], default="dirs",
+                        help="dirs: 按 <划分>/<类别>/ 保存 JPEG；shards: 直接写入 tar 分片")
+    parser.add_argument("--restart", action="store_true", help="忽略已有清单，从头处理")
+    args = parser.parse_args()
+
+    chunk_size = args.chunk_size or (512 if args.format == "shards" else 32)
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.format == "dirs":
+        for split in SPLITS:
+            os.makedirs(os.path.join(args.output_dir, split), exist_ok=True)
+
+    manifest_path = os.path.join(args.output_dir, manifest_name)
+    if args.restart and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    done = load_manifest(manifest_path)
+
+    # 获取所有的标签文件，跳过清单中已完成的
+    label_files = sorted(f for f in os.listdir(args.label_dir) if f.endswith(".txt"))
+    todo = [f for f in label_files if f not in done]
+    if done:
+        print(f"已完成 {len(done)} 个标签文件，本次继续处理剩余 {len(todo)} 个")
+
+    # 块编号取块内第一个文件在全部文件中的序号，续跑时不会与已有分片重名
+    position = {f: i for i, f in enumerate(label_files)}
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    tasks = [(chunk, position[chunk[0]], args.img_dir, args.label_dir, args.output_dir, args.format)
+             for chunk in chunks]
+
+    split_counts = Counter()
+    error_count = 0
+    with open(manifest_path, "a", encoding="utf-8") as manifest, Pool(args.workers) as pool, \
+            tqdm(total=len(todo), desc="Processing images", unit="file") as bar:
+        for results in pool.imap_unordered(process_chunk, tasks):
+            for record in results:
+                # 每个标签文件处理完才写入清单，中断时未写入的文件下次会重新处理
+                manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+                done[record["label_file"]] = record
+                split_counts.update(split for split, _, _ in record["crops"])
+                error_count += len(record["errors"])
+            manifest.flush()
+            bar.update(len(results))
+            bar.set_postfix(train=split_counts["train"], val=split_counts["val"], test=split_counts["test"],
+                            errors=error_count)
+
+    # 汇总全部进程（包括之前中断的运行）的错误日志和划分统计
+    totals = Counter()
+    with open(error_log, "w") as log_file:
+        for record in done.values():
+            totals.update(split for split, _, _ in record["crops"])
+            for error in record["errors"]:
+                log_file.write(error + "\n")
+    error_total = sum(len(record["errors"]) for record in done.values())
+    if args.format == "shards":
+        # 汇总每个划分的分片列表和各类别数量
+        split_records = {split: {"shards": set(), "class_counts": Counter()} for split in SPLITS}
+        for record in done.values():
+            for split, shard in record.get("shards", {}).items():
+                split_records[split]["shards"].add(shard)
+            for split, class_id, _ in record["crops"]:
+                split_records[split]["class_counts"][class_id] += 1
+        write_index(args.output_dir, split_records)
+    print(f"裁剪数量: train {totals['train']}, val {totals['val']}, test {totals['test']}；"
+          f"错误 {error_total} 条，详见 {error_log}")
+    print("✅ 数据集转换并划分完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,3 +5,7 @@ from torchvision.datasets import ImageFolder
 # 加载训练集
 train_dataset = ImageFolder(r"E:\studycode\py\pythonProject\mypy_data\plantvillage_splitted\train")
 print("类别索引映射:", train_dataset.class_to_idx)
+
+# 推理时使用的映射数组可直接由 class_to_idx 生成，无需手工维护
+from plantvillage.labels import build_class_index
+print("映射数组 (模型输出下标 -> 类别编号):", build_class_index(train_dataset.class_to_idx))
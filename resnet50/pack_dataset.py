@@ -0,0 +1,35 @@
+# 把 plantvillage_splitted 的各个划分一次性解码打包为内存映射的 uint8 数组，训练时不再重复解码 JPEG
+# 用法：python pack_dataset.py --root E:/wjx/py/mydata/plantvillage_splitted --out E:/wjx/py/mydata/plantvillage_packed
+import argparse
+import os
+
+from tqdm import tqdm
+
+from plantvillage.packed import pack_split
+
+
+def main():
+    parser = argparse.ArgumentParser(description="打包数据集为内存映射数组")
+    parser.add_argument("--root", default="E:/wjx/py/mydata/plantvillage_splitted", help="ImageFolder 格式的数据集根目录")
+    parser.add_argument("--out", default="E:/wjx/py/mydata/plantvillage_packed", help="输出目录")
+    parser.add_argument("--splits", nargs="+", default=["train", "val", "test"])
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    for split in args.splits:
+        bar = tqdm(desc=f"打包 {split}", unit="img")
+
+        def progress(done, total):
+            bar.total = total
+            bar.update(done - bar.n)
+
+        errors = pack_split(args.root, args.out, split, args.size, args.workers, progress)
+        bar.close()
+        for error in errors:
+            print(f"⚠️ 无法读取图像 {error}")
+    print("✅ 数据集打包完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+# 植物病害识别的公共模块：类别表、预处理、模型加载与推理
+# labels 不依赖 torch，桌面客户端也可以直接导入；其余模块按需导入：
+#   from plantvillage.predictor import Predictor, get_predictor
+#   from plantvillage.preprocess import TRANSFORM
+from .labels import IMAGEFOLDER_LIST, NUM_CLASSES, PLANT_LIST
@@ -0,0 +1,156 @@
+import base64
+import io
+import json
+import zipfile
+
+import torch
+
+from . import config
+
+# 压缩包中会被当作图片处理的文件扩展名
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+class BatchTooLarge(Exception):
+    """单个批量请求中的图片数超过 MAX_BATCH_ITEMS"""
+
+
+def is_zip(filename, content_type=None):
+    return (content_type or "").split(";")[0].strip() in ZIP_CONTENT_TYPES or \
+        (filename or "").lower().endswith(".zip")
+
+
+def is_ndjson(content_type):
+    return (content_type or "").split(";")[0].strip() in NDJSON_CONTENT_TYPES
+
+
+def iter_zip(data):
+    """逐个取出 zip 压缩包中的图片，返回 (文件名, 字节, 错误信息) 的迭代器
+
+    压缩包格式和图片数量在调用时立即检查，便于在开始流式返回前拒绝请求。
+    """
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    infos = [info for info in archive.infolist()
+             if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)]
+    if len(infos) > config.MAX_BATCH_ITEMS:
+        archive.close()
+        raise BatchTooLarge(f"单次最多上传 {config.MAX_BATCH_ITEMS} 张图片")
+
+    def entries():
+        with archive:
+            for info in infos:
+                yield info.filename, archive.read(info), None
+    return entries()
+
+
+def parse_ndjson_line(line, index):
+    """解析一行 {"name": ..., "image": "<base64>"}，格式错误时返回错误信息而不是抛出异常"""
+    try:
+        record = json.loads(line)
+        name = str(record.get("name", index))
+        return name, base64.b64decode(record["image"], validate=True), None
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return str(index), None, f"无法解析第 {index} 行: {e}"
+
+
+def iter_ndjson(lines):
+    index = 0
+    for line in lines:
+        if line.strip():
+            yield parse_ndjson_line(line, index)
+            index += 1
+
+
+async def aiter_ndjson(chunks):
+    """从异步字节流中逐行解析 NDJSON，边接收边产出，不等整个请求体上传完"""
+    buffer = b""
+    index = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_ndjson_line(line, index)
+                index += 1
+    if buffer.strip():
+        yield parse_ndjson_line(buffer, index)
+
+
+def limit_items(items):
+    """限制单个请求的图片数量，超出时抛出 BatchTooLarge"""
+    for count, item in enumerate(items, start=1):
+        if count > config.MAX_BATCH_ITEMS:
+            raise BatchTooLarge(f"单次最多上传 {config.MAX_BATCH_ITEMS} 张图片")
+        yield item
+
+
+async def alimit_items(items):
+    count = 0
+    async for item in items:
+        count += 1
+        if count > config.MAX_BATCH_ITEMS:
+            raise BatchTooLarge(f"单次最多上传 {config.MAX_BATCH_ITEMS} 张图片")
+        yield item
+
+
+async def aiterate(items):
+    for item in items:
+        yield item
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def to_ndjson(record):
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def safe_preprocess(predictor, data, cache, top_k=1):
+    """在解码线程中调用：返回 (缓存键, 缓存结果, 张量, 错误信息)，单张坏图不影响整批"""
+    try:
+        keys, cached, tensor = cache.lookup_or_preprocess(predictor, data, top_k)
+        return keys, cached, tensor, None
+    except Exception as e:
+        return [], None, None, f"无法解码图片: {e}"
+
+
+def error_record(index, name, error):
+    return {"index": index, "name": name, "error": error}
+
+
+def result_record(index, name, result):
+    return dict(result, index=index, name=name)
+
+
+def predict_stream(predictor, items, pool, cache, top_k=1, batch_size=None):
+    """同步版批量预测：分块并行解码，未命中缓存的图片每块做一次批量前向，逐行产出 NDJSON 结果"""
+    batch_size = batch_size or config.MAX_BATCH_SIZE
+    index = 0
+    for chunk in chunked(limit_items(items), batch_size):
+        decoded = list(pool.map(
+            lambda item: safe_preprocess(predictor, item[1], cache, top_k) if item[2] is None
+            else ([], None, None, item[2]), chunk))
+        results = {i: cached for i, (_, cached, _, _) in enumerate(decoded) if cached is not None}
+        todo = [i for i, (_, _, tensor, _) in enumerate(decoded) if tensor is not None]
+        if todo:
+            outputs = predictor.predict_tensors(torch.stack([decoded[i][2] for i in todo]), top_k)
+            for i, result in zip(todo, outputs):
+                cache.put(decoded[i][0], result)
+                results[i] = result
+        for i, (name, _, _) in enumerate(chunk):
+            if i in results:
+                yield to_ndjson(result_record(index + i, name, results[i]))
+            else:
+                yield to_ndjson(error_record(index + i, name, decoded[i][3]))
+        index += len(chunk)
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+from . import config
+from .metrics import stage_timer
+from .preprocess import INPUT_SIZE, load_image
+
+
+def content_hash(data):
+    """上传字节的快速哈希（blake2b，128 位）"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def perceptual_hash(image):
+    """差值哈希 dHash：对重新编码、轻微缩放后的同一画面保持不变
+
+    只有 64 位，相似构图的不同照片也会得到相同的值，按它命中的结果是近似的。
+    """
+    pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] < pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+class PredictionCache:
+    """按图片内容缓存预测结果：内存 LRU + TTL，可选 SQLite 持久化层
+
+    缓存按实际加载的模型（Predictor.model_version，即权重哈希）隔离，而不是磁盘上的模型文件：
+    运行中替换模型文件（加载后不保留文件映射，Windows 上也可以覆盖）不影响正在服务的模型，
+    重启后加载了新模型，旧模型的结果自动失效。
+    感知哈希（PV_CACHE_PHASH）只按 64 位 dHash 匹配，不同照片可能碰撞而返回错误的结果，只在能接受近似结果时开启。
+    缓存写入失败（例如 SQLite 数据库被其他进程锁住）只记录警告，不影响本次预测的返回。
+    """
+
+    def __init__(self, max_entries=None, ttl=None, db_path=None, use_phash=None):
+        self.max_entries = config.CACHE_SIZE if max_entries is None else max_entries
+        self.ttl = config.CACHE_TTL if ttl is None else ttl
+        self.db_path = config.CACHE_DB if db_path is None else db_path
+        self.use_phash = config.CACHE_PHASH if use_phash is None else use_phash
+        self._entries = OrderedDict()  # key -> (写入时间, 结果)
+        self._lock = threading.Lock()
+        self._db = None
+        if self.enabled and self.db_path:
+            # 多个线程共用一个连接，由 _lock 串行化访问
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions ("
+                             "key TEXT PRIMARY KEY, model TEXT, created REAL, value TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS predictions_created ON predictions (created)")
+            self._db.commit()
+        self._model_version = None  # 第一次查找时取自 predictor
+        self._purged_at = 0.0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.write_errors = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _use_model(self, version):
+        # 模型变化后清空内存层，磁盘层删除其他模型的结果（包括上次运行时旧模型留下的）
+        if version == self._model_version:
+            return
+        with self._lock:
+            if version == self._model_version:
+                return
+            if self._model_version is not None:
+                self.invalidations += 1
+            self._model_version = version
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions WHERE model != ?", (version,))
+                self._db.commit()
+
+    def _purge_expired(self, now):
+        # 磁盘层过期的行不会再被读取，定期删除，避免数据库无限增长；调用方持有 _lock
+        if self._db is None or now - self._purged_at < min(self.ttl, 60.0):
+            return
+        self._purged_at = now
+        deleted = self._db.execute("DELETE FROM predictions WHERE created < ?", (now - self.ttl,)).rowcount
+        self.expirations += max(deleted, 0)
+
+    def _get_one(self, key):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            created, value = entry
+            if now - created <= self.ttl:
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+            self.expirations += 1
+        if self._db is not None:
+            row = self._db.execute("SELECT created, value FROM predictions WHERE key = ? AND model = ?",
+                                   (key, self._model_version)).fetchone()
+            if row is not None and now - row[0] <= self.ttl:
+                value = json.loads(row[1])
+                self._store_memory(key, row[0], value)
+                self.disk_hits += 1
+                return value
+        return None
+
+    def _store_memory(self, key, created, value):
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _lookup(self, keys):
+        with self._lock:
+            for key in keys:
+                value = self._get_one(key)
+                if value is not None:
+                    return value
+        return None
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get(self, keys):
+        """依次查找多个候选键，命中任意一个即返回"""
+        if not self.enabled:
+            return None
+        return self._count(self._lookup(keys))
+
+    def put(self, keys, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._store_memory(key, now, value)
+            if self._db is not None:
+                payload = json.dumps(value, ensure_ascii=False)
+                try:
+                    self._db.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+                                         [(key, self._model_version, now, payload) for key in keys])
+                    self._purge_expired(now)
+                    self._db.commit()
+                except sqlite3.Error as error:
+                    # 磁盘层只是加速，写不进去时结果仍留在内存层
+                    self._db.rollback()
+                    self.write_errors += 1
+                    print(f"⚠️ 预测缓存写入失败: {error}")
+
+    def lookup_or_preprocess(self, predictor, data, top_k=1):
+        """在解码线程中调用：返回 (缓存键, 缓存结果, 输入张量)
+
+        命中时不再解码；启用感知哈希时先用字节哈希查找，未命中再用解码后的图像计算感知哈希。
+        """
+        if not self.enabled:
+            return [], None, predictor.preprocess(data)
+        self._use_model(predictor.model_version)
+        keys = [f"b:{content_hash(data)}:{top_k}"]
+        cached = self._lookup(keys)
+        if cached is not None:
+            return keys, self._count(cached), None
+        with stage_timer("decode"):
+            image = load_image(data, INPUT_SIZE if config.FAST_DECODE else None)
+        if self.use_phash:
+            keys.append(f"p:{perceptual_hash(image)}:{top_k}")
+            cached = self._lookup(keys[1:])
+            if cached is not None:
+                # 记住这份字节，下次直接按字节哈希命中
+                self.put(keys[:1], cached)
+                return keys, self._count(cached), None
+        self._count(None)
+        return keys, None, predictor.preprocess(image)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "disk": bool(self._db is not None),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "write_errors": self.write_errors,
+        }
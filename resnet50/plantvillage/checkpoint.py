@@ -0,0 +1,118 @@
+import hashlib
+import os
+import pickle
+
+import torch
+from torchvision import models
+
+# 模型文件只保存 state_dict 和元数据，不再 pickle 整个模型对象：
+#   部署格式  {"format": "plantvillage-model", "arch", "num_classes", "class_to_idx", "hash", "state_dict"}
+#   训练检查点 在部署格式基础上增加 optimizer、scheduler、scaler、early_stopping、epoch、best_loss
+# 两种文件都可以直接给推理服务加载；旧版 torch.save(model) 保存的整模型文件仍然兼容
+MODEL_FORMAT = "plantvillage-model"
+CHECKPOINT_FORMAT = "plantvillage-checkpoint"
+FORMAT_VERSION = 1
+
+
+def state_hash(state_dict):
+    """按参数名和原始字节计算的内容哈希，与文件路径、保存时间无关"""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(state_dict):
+        tensor = state_dict[name].detach().cpu().contiguous()
+        digest.update(name.encode("utf-8"))
+        digest.update(tensor.reshape(-1).view(torch.uint8).numpy())
+    return digest.hexdigest()
+
+
+def _model_payload(model, class_to_idx, arch="resnet50"):
+    state_dict = {name: tensor.detach().cpu() for name, tensor in model.state_dict().items()}
+    return {
+        "version": FORMAT_VERSION,
+        "arch": arch,
+        "num_classes": model.fc.out_features,
+        "class_to_idx": dict(class_to_idx) if class_to_idx is not None else None,
+        "hash": state_hash(state_dict),
+        "state_dict": state_dict,
+    }
+
+
+def _atomic_save(payload, path):
+    # 先写临时文件再改名，训练中途被打断也不会留下损坏的文件
+    tmp_path = path + ".tmp"
+    torch.save(payload, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def export_model(model, class_to_idx, path, arch="resnet50"):
+    """保存部署格式：只有权重和类别映射，加载时不反序列化模型对象"""
+    payload = _model_payload(model, class_to_idx, arch)
+    payload["format"] = MODEL_FORMAT
+    _atomic_save(payload, path)
+    return payload["hash"]
+
+
+def save_checkpoint(path, model, class_to_idx, optimizer, scheduler, early_stopping, epoch, best_loss,
+                    scaler=None, arch="resnet50"):
+    """保存训练检查点，--resume 时从下一个 epoch 继续"""
+    payload = _model_payload(model, class_to_idx, arch)
+    payload.update({
+        "format": CHECKPOINT_FORMAT,
+        "optimizer": optimizer.state_dict(),
+        "scheduler": scheduler.state_dict(),
+        "scaler": scaler.state_dict() if scaler is not None else None,
+        "early_stopping": early_stopping.state_dict(),
+        "epoch": epoch,
+        "best_loss": best_loss,
+    })
+    _atomic_save(payload, path)
+
+
+def load_checkpoint(path, map_location="cpu"):
+    """读取训练检查点并校验权重哈希"""
+    payload = torch.load(path, map_location=map_location, weights_only=True)
+    if payload.get("format") != CHECKPOINT_FORMAT:
+        raise ValueError(f"{path} 不是训练检查点")
+    if state_hash(payload["state_dict"]) != payload["hash"]:
+        raise ValueError(f"{path} 的权重哈希不匹配，文件可能已损坏")
+    return payload
+
+
+def _read_payload(path, mmap):
+    try:
+        # 只含张量和基本类型，weights_only 加载不执行任意代码；mmap 时权重按需从页缓存读取
+        return torch.load(path, map_location="cpu", mmap=mmap, weights_only=True)
+    except pickle.UnpicklingError:
+        return None  # 旧版整模型文件
+
+
+def build_model(arch, num_classes):
+    # 在 meta 设备上构建，跳过无用的随机初始化，随后由 load_state_dict(assign=True) 直接接管权重
+    with torch.device("meta"):
+        return getattr(models, arch)(num_classes=num_classes)
+
+
+def load_model_file(path, device=None, mmap=False):
+    """加载部署格式、训练检查点或旧版整模型文件，返回 (模型, 元数据)
+
+    默认把权重完整读入内存、不保留文件映射：Windows 上被映射的文件不能被 os.replace 覆盖，
+    推理服务或 Pui 运行时训练保存 best_resnet50.pth 会失败。mmap=True 只适合短暂读取。
+    """
+    payload = _read_payload(path, mmap)
+    if payload is None:
+        # best_resnet50.pth 的旧格式是整个模型对象，需要完整反序列化；哈希按加载到的权重计算
+        model = torch.load(path, map_location=device if device is not None else "cpu", weights_only=False)
+        return model, {"hash": state_hash(model.state_dict())}
+    model = build_model(payload["arch"], payload["num_classes"])
+    model.load_state_dict(payload.pop("state_dict"), assign=True)
+    if device is not None:
+        model.to(device)
+    return model, read_metadata(path, payload)
+
+
+def read_metadata(path, payload=None):
+    """模型文件中的类别映射、哈希等元数据；旧版整模型文件返回空字典"""
+    if payload is None:
+        payload = _read_payload(path, mmap=True)
+    if payload is None:
+        return {}
+    return {key: payload.get(key) for key in ("format", "arch", "num_classes", "class_to_idx", "hash", "epoch")}
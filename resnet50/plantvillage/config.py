@@ -0,0 +1,46 @@
+import os
+
+# 服务端可调参数，统一从环境变量读取，方便部署时调整而不改代码
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+# 模型文件路径，默认与原脚本一致，在 resnet50 目录下启动服务
+MODEL_PATH = os.environ.get("PV_MODEL_PATH", "best_resnet50.pth")
+# 启动时预热的前向次数；是否额外用 TorchScript 冻结模型（折叠 BN 等常量，启动稍慢）
+WARMUP_ITERS = env_int("PV_WARMUP_ITERS", 2)
+JIT_FREEZE = env_int("PV_JIT_FREEZE", 0)
+
+# 是否使用快速解码：JPEG 在 DCT 域直接缩小到接近 224 再缩放，并以 uint8 张量交给推理线程归一化
+FAST_DECODE = env_int("PV_FAST_DECODE", 1)
+
+# 动态批处理：单批最大样本数、凑批最长等待时间（毫秒）、排队上限（0 表示不限）
+MAX_BATCH_SIZE = env_int("PV_MAX_BATCH_SIZE", 16)
+MAX_WAIT_MS = env_float("PV_MAX_WAIT_MS", 5.0)
+MAX_QUEUE_SIZE = env_int("PV_MAX_QUEUE_SIZE", 0)
+
+# 执行层：解码/预处理线程数、推理线程数（同时进行的批次数）、在途请求上限（超出返回 503）
+CPU_COUNT = os.cpu_count() or 1
+DECODE_WORKERS = env_int("PV_DECODE_WORKERS", min(4, CPU_COUNT))
+INFERENCE_WORKERS = env_int("PV_INFERENCE_WORKERS", 1)
+MAX_PENDING = env_int("PV_MAX_PENDING", 64)
+# 每个推理线程内部 PyTorch 算子使用的线程数，默认把全部核心平均分给推理线程，避免超额订阅
+TORCH_THREADS = env_int("PV_TORCH_THREADS", max(1, CPU_COUNT // INFERENCE_WORKERS))
+
+# 批量预测：单个请求最多包含的图片数
+MAX_BATCH_ITEMS = env_int("PV_MAX_BATCH_ITEMS", 1024)
+
+# 预测缓存：内存条目上限（0 关闭缓存）、过期时间（秒）、可选的 SQLite 持久化文件、是否启用感知哈希
+CACHE_SIZE = env_int("PV_CACHE_SIZE", 4096)
+CACHE_TTL = env_float("PV_CACHE_TTL", 3600.0)
+CACHE_DB = os.environ.get("PV_CACHE_DB", "")
+# 感知哈希只有 64 位且只比较画面轮廓，不同照片也可能得到同一个键而返回别人的结果，属于近似缓存，默认关闭
+CACHE_PHASH = env_int("PV_CACHE_PHASH", 0)
@@ -0,0 +1,90 @@
+import itertools
+import os
+import time
+
+import torch
+from torch.utils.data import DataLoader, IterableDataset, Subset
+
+
+def loader_config(device, num_workers=None, pin_memory=None, prefetch_factor=None, persistent_workers=None):
+    """根据核心数和设备自动选择 DataLoader 参数，显式传入的值优先"""
+    if num_workers is None:
+        # 留一个核心给训练主进程
+        num_workers = min(8, max(0, (os.cpu_count() or 1) - 1))
+    if pin_memory is None:
+        # 锁页内存只对拷贝到 GPU 有帮助
+        pin_memory = device.type == "cuda"
+    config = {"num_workers": num_workers, "pin_memory": pin_memory}
+    if num_workers > 0:
+        # 子进程跨 epoch 常驻，省去每个 epoch 重新拉起进程、重新打开数据集的开销
+        config["persistent_workers"] = True if persistent_workers is None else persistent_workers
+        config["prefetch_factor"] = prefetch_factor or 2
+    return config
+
+
+def make_loader(dataset, batch_size, shuffle, config):
+    if isinstance(dataset, IterableDataset):
+        # 流式数据集（如 ShardDataset）自己负责打乱顺序
+        shuffle = False
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, **config)
+
+
+class StrideSubset(IterableDataset):
+    """流式数据集的抽样：每 stride 个样本取一个，样本分布在所有分片中而不是集中在前几个分片"""
+
+    def __init__(self, dataset, stride):
+        self.dataset = dataset
+        self.stride = stride
+
+    def __len__(self):
+        return -(-len(self.dataset) // self.stride)
+
+    def __iter__(self):
+        return itertools.islice(iter(self.dataset), 0, None, self.stride)
+
+
+def subsample(dataset, fraction, seed=0):
+    """固定抽取 fraction 比例的样本用于快速验证；每次抽到的都是同一批样本，验证损失前后可比"""
+    if fraction >= 1:
+        return dataset
+    if isinstance(dataset, IterableDataset):
+        return StrideSubset(dataset, max(1, round(1 / fraction)))
+    count = max(1, int(len(dataset) * fraction))
+    indices = torch.randperm(len(dataset), generator=torch.Generator().manual_seed(seed))[:count]
+    return Subset(dataset, indices.sort().values.tolist())
+
+
+class LoaderTimer:
+    """统计一个 epoch 中等待数据的时间和计算时间，判断训练是否受限于数据加载
+
+    用法：for images, labels in timer.wrap(loader): ...
+    """
+
+    def __init__(self):
+        self.data_time = 0.0
+        self.compute_time = 0.0
+        self.batches = 0
+
+    def wrap(self, loader):
+        iterator = iter(loader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            fetched = time.perf_counter()
+            self.data_time += fetched - start
+            self.batches += 1
+            yield batch
+            # 循环体（拷贝、前向、反向、更新）的耗时算作计算时间
+            self.compute_time += time.perf_counter() - fetched
+
+    @property
+    def data_ratio(self):
+        total = self.data_time + self.compute_time
+        return self.data_time / total if total else 0.0
+
+    def summary(self):
+        return (f"数据等待 {self.data_time:.1f}s / 计算 {self.compute_time:.1f}s"
+                f"（等待占比 {self.data_ratio * 100:.1f}%{'，受限于数据加载' if self.data_ratio > 0.2 else ''}）")
@@ -0,0 +1,140 @@
+import asyncio
+from collections import Counter
+
+import torch
+
+from . import config
+
+
+class BatchingEngine:
+    """动态批处理推理引擎：把并发请求聚合成一个批次，只做一次前向推理"""
+
+    def __init__(self, infer_fn, max_batch_size=None, max_wait_ms=None, max_queue_size=None, executor=None,
+                 max_concurrent_batches=1):
+        # infer_fn(tensors, options)：tensors 形状为 (N, C, H, W)，options 为每个请求的附加参数，返回长度为 N 的结果列表
+        self.infer_fn = infer_fn
+        self.max_batch_size = max_batch_size or config.MAX_BATCH_SIZE
+        self.max_wait_ms = config.MAX_WAIT_MS if max_wait_ms is None else max_wait_ms
+        self.max_queue_size = config.MAX_QUEUE_SIZE if max_queue_size is None else max_queue_size
+        self.executor = executor  # None 时使用事件循环默认线程池
+        # 同时执行的批次数，一般与推理线程池的线程数一致
+        self.max_concurrent_batches = max_concurrent_batches
+        self.batch_size_hist = Counter()  # 批大小 -> 出现次数
+        self.num_batches = 0
+        self.num_items = 0
+        self._queue = None
+        self._slots = None
+        self._worker_task = None
+        self._batch_tasks = set()
+
+    async def start(self):
+        """在事件循环中启动后台凑批协程"""
+        if self._worker_task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker_task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        """停止后台协程，并让仍在排队的请求失败返回"""
+        if self._worker_task is not None:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+        for task in list(self._batch_tasks):
+            task.cancel()
+        while self._queue is not None and not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("推理引擎已停止"))
+
+    async def submit(self, tensor, option=None):
+        """提交单张预处理后的图像张量 (C, H, W) 及其附加参数，等待属于它自己的结果"""
+        if self._worker_task is None:
+            raise RuntimeError("推理引擎尚未启动")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((tensor, option, future))
+        return await future
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        """返回引擎参数、队列深度和批大小分布"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "max_queue_size": self.max_queue_size,
+            "max_concurrent_batches": self.max_concurrent_batches,
+            "running_batches": len(self._batch_tasks),
+            "queue_depth": self.queue_depth,
+            "batches": self.num_batches,
+            "items": self.num_items,
+            "avg_batch_size": self.num_items / self.num_batches if self.num_batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_size_hist.items())},
+        }
+
+    async def _collect_batch(self):
+        # 阻塞等待第一个请求，之后在 max_wait_ms 内尽量凑满一个批次
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            # 先占到执行槽位再凑批：推理线程都在忙时，新请求继续在队列里累积成更大的批次
+            await self._slots.acquire()
+            try:
+                batch = await self._collect_batch()
+            except BaseException:
+                self._slots.release()
+                raise
+            # 客户端断开等原因已取消的请求不再参与推理
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                self._slots.release()
+                continue
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    def _forward(self, batch):
+        # 在推理线程中拼接批次并推理，拼接拷贝也不占用事件循环
+        tensors = torch.stack([tensor for tensor, _, _ in batch])
+        return self.infer_fn(tensors, [option for _, option, _ in batch])
+
+    async def _run_batch(self, batch):
+        try:
+            self.batch_size_hist[len(batch)] += 1
+            self.num_batches += 1
+            self.num_items += len(batch)
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(self.executor, self._forward, batch)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
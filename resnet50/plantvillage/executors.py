@@ -0,0 +1,59 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import torch
+
+from . import config
+
+
+class Overloaded(Exception):
+    """在途请求已达上限，调用方应返回 503 让客户端稍后重试"""
+
+
+class ExecutionLayer:
+    """把阻塞的解码、预处理和前向推理从事件循环线程中移走"""
+
+    def __init__(self, decode_workers=None, inference_workers=None, max_pending=None):
+        self.decode_workers = decode_workers or config.DECODE_WORKERS
+        self.inference_workers = inference_workers or config.INFERENCE_WORKERS
+        self.max_pending = max_pending or config.MAX_PENDING
+        # 解码/预处理：PIL 解码和 torchvision 变换大部分时间会释放 GIL，适合线程池
+        self.decode_pool = ThreadPoolExecutor(self.decode_workers, thread_name_prefix="pv-decode")
+        # 推理专用线程池，线程数即可同时执行的批次数
+        self.inference_pool = ThreadPoolExecutor(self.inference_workers, thread_name_prefix="pv-infer")
+        self.pending = 0
+        self.rejected = 0
+
+    async def run_decode(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.decode_pool, fn, *args)
+
+    async def run_inference(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.inference_pool, fn, *args)
+
+    @contextmanager
+    def admit(self):
+        """准入控制：在途请求超过 max_pending 时直接拒绝，而不是无限排队"""
+        # 只在事件循环线程中调用，普通计数器即可
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded(f"服务繁忙，当前在途请求 {self.pending} 个")
+        self.pending += 1
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {
+            "decode_workers": self.decode_workers,
+            "inference_workers": self.inference_workers,
+            "torch_threads": torch.get_num_threads(),
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self.decode_pool.shutdown(wait=False)
+        self.inference_pool.shutdown(wait=False)
@@ -0,0 +1,101 @@
+import json
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import Dataset
+
+from .preprocess import normalize
+
+# 每个数据划分对应三个文件：<split>.features.npy（float16, N x 2048）、<split>.labels.npy、<split>.index.json
+FEATURE_DIM = 2048
+
+
+def split_paths(out_dir, split):
+    prefix = os.path.join(out_dir, split)
+    return prefix + ".features.npy", prefix + ".labels.npy", prefix + ".index.json"
+
+
+def backbone_of(model):
+    """取 ResNet 去掉 fc 的部分，输出全局池化后的特征向量；与原模型共享参数"""
+    return nn.Sequential(*list(model.children())[:-1], nn.Flatten(1))
+
+
+def attach_head(model, head):
+    """把在特征缓存上训练好的线性层装回完整模型，得到可直接推理或继续全量微调的模型"""
+    model.fc = nn.Linear(head.in_features, head.out_features)
+    model.fc.load_state_dict(head.state_dict())
+    return model
+
+
+def extract_split(model, loader, out_dir, split, device, classes, class_to_idx, source, progress=None):
+    """用骨干网络对一个划分跑一遍前向，把池化特征写入 float16 内存映射文件，返回写入的样本数"""
+    features_path, labels_path, index_path = split_paths(out_dir, split)
+    os.makedirs(out_dir, exist_ok=True)
+    capacity = len(loader.dataset)
+    features = np.lib.format.open_memmap(features_path, mode="w+", dtype=np.float16,
+                                         shape=(capacity, FEATURE_DIM))
+    labels = np.full(capacity, -1, dtype=np.int64)
+
+    backbone = backbone_of(model).to(device).eval()
+    count = 0
+    with torch.inference_mode():
+        for images, targets in loader:
+            images = images.to(device, non_blocking=True)
+            if images.dtype == torch.uint8:
+                images = normalize(images)
+            batch = backbone(images).to(torch.float16).cpu().numpy()
+            features[count:count + len(batch)] = batch
+            labels[count:count + len(batch)] = targets.numpy()
+            count += len(batch)
+            if progress is not None:
+                progress(count, capacity)
+    features.flush()
+    del features
+    np.save(labels_path, labels)
+
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "split": split,
+            "count": count,
+            "dim": FEATURE_DIM,
+            "classes": classes,
+            "class_to_idx": class_to_idx,
+            "source": source,  # 提取特征所用的骨干网络：imagenet 或模型文件路径
+        }, f, ensure_ascii=False)
+    return count
+
+
+class FeatureDataset(Dataset):
+    """读取 extract_split 生成的特征缓存；每个样本返回 float32 特征 (2048,) 和标签
+
+    特征以只读方式映射，整个划分通常只有几百 MB，训练线性层时可以直接按批切片。
+    """
+
+    def __init__(self, out_dir, split):
+        features_path, labels_path, index_path = split_paths(out_dir, split)
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        self.classes = index["classes"]
+        self.class_to_idx = index["class_to_idx"]
+        self.source = index["source"]
+        self.features = np.load(features_path, mmap_mode="r")
+        labels = np.load(labels_path)
+        self.indices = np.flatnonzero(labels[:index["count"]] >= 0)
+        self.targets = labels[self.indices]
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        feature = torch.from_numpy(self.features[self.indices[index]].astype(np.float32))
+        return feature, int(self.targets[index])
+
+    def batches(self, batch_size, shuffle=False, generator=None):
+        """不经过 DataLoader 直接按批读取：一次切片取整批特征，比逐样本读取快得多"""
+        order = torch.randperm(len(self), generator=generator).numpy() if shuffle else np.arange(len(self))
+        for start in range(0, len(order), batch_size):
+            chunk = np.sort(order[start:start + batch_size]) if shuffle else order[start:start + batch_size]
+            features = torch.from_numpy(self.features[self.indices[chunk]].astype(np.float32))
+            yield features, torch.from_numpy(self.targets[chunk])
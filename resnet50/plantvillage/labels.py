@@ -0,0 +1,33 @@
+import numpy as np
+
+# 类别表：训练集目录名 0~37 对应的中文病害名称
+PLANT_LIST = ["苹果黑星病","苹果黑腐病","苹果桧胶锈病","苹果健康叶","蓝莓健康叶","樱桃白粉病","樱桃健康叶",
+              "玉米灰斑病","玉米普通锈病","玉米叶枯病","玉米健康叶","葡萄黑腐病","葡萄黑痘病","葡萄叶枯病",
+              "葡萄健康叶","柑橘黄龙病","桃细菌性穿孔病","桃树健康叶","甜椒细菌性叶斑病","甜椒健康叶","土豆早疫病",
+              "土豆晚疫病","土豆健康叶","树莓健康叶","大豆健康叶","南瓜白粉病","草莓炭疽病","草莓健康叶",
+              "番茄细菌性斑疹病","番茄早疫病","番茄晚疫病","番茄叶霉病","番茄灰叶斑病","番茄二斑叶螨",
+              "番茄斑点病","番茄叶黄病毒病","番茄花叶病毒病","番茄健康叶"]
+
+NUM_CLASSES = len(PLANT_LIST)
+
+
+def build_class_index(class_to_idx=None):
+    """由 ImageFolder 的 class_to_idx（目录名 -> 下标）生成映射数组：index[模型输出下标] = 类别编号
+
+    不传 class_to_idx 时按 ImageFolder 的规则推导：目录名 '0'~'37' 按字符串排序后依次编号。
+    """
+    if class_to_idx is None:
+        class_to_idx = {name: idx for idx, name in enumerate(sorted(str(i) for i in range(NUM_CLASSES)))}
+    index = np.empty(len(class_to_idx), dtype=np.int64)
+    for name, idx in class_to_idx.items():
+        index[idx] = int(name)
+    return index
+
+
+# 模型输出下标 -> 类别编号，推理时对整批结果做一次 gather 即可完成映射
+CLASS_INDEX = build_class_index()
+# 模型输出下标 -> 中文名称，可直接用下标数组整体索引
+CLASS_NAMES = np.array(PLANT_LIST, dtype=object)[CLASS_INDEX]
+
+# 兼容旧代码的字典形式：{ImageFolder 下标: 类别编号}
+IMAGEFOLDER_LIST = {idx: int(class_id) for idx, class_id in enumerate(CLASS_INDEX)}
@@ -0,0 +1,204 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Prometheus 文本格式的指标，不依赖 prometheus_client；两个服务的 /metrics 都调用 render()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 延迟分桶（秒）：从单张图片的解码到排队严重时的整个请求
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # 标签 -> [各桶计数..., 总和, 样本数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, ('le', _number(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, ('le', '+Inf'))} {state[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(float(state[-2]))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class Callback:
+    """采集时才取值的指标，适合队列深度、缓存计数这类已经由其他对象维护的数值
+
+    fn 返回一个数值，或 {标签值: 数值} 字典（此时需要指定 labelname）；返回 None 时不输出。
+    """
+
+    def __init__(self, name, documentation, fn, kind="gauge", labelname=None):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.kind = kind
+        self.labelname = labelname
+
+    def render(self):
+        value = self.fn()
+        if value is None:
+            return []
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if isinstance(value, dict):
+            for label, item in value.items():
+                lines.append(f"{self.name}{_labels((self.labelname,), (label,))} {_number(item)}")
+        else:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        # 同名指标只保留最后注册的一个，重复导入/重载模块时不会输出重复的指标
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "pv_requests_total", "按接口、方法和状态码统计的请求数", ("endpoint", "method", "status")))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "pv_request_duration_seconds", "请求处理耗时", LATENCY_BUCKETS, ("endpoint",)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "pv_stage_duration_seconds", "各处理阶段耗时：read/decode/transform/forward/postprocess", LATENCY_BUCKETS, ("stage",)))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "pv_batch_size", "每次前向推理的批大小", BATCH_BUCKETS))
+
+
+@contextmanager
+def stage_timer(stage):
+    """记录一个处理阶段的耗时：with stage_timer("decode"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def observe_request(endpoint, method, status, seconds):
+    REQUESTS.inc(endpoint=endpoint, method=method, status=status)
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+
+
+def resident_memory_bytes():
+    """当前进程的常驻内存；Linux 读 /proc，其他类 Unix 平台退而取峰值，Windows 下不可用"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+REGISTRY.register(Callback("pv_process_resident_memory_bytes", "进程常驻内存（字节）", resident_memory_bytes))
+
+
+def register_cache_metrics(cache):
+    """预测缓存的命中情况，数值直接取自 PredictionCache 的计数器"""
+    REGISTRY.register(Callback(
+        "pv_cache_lookups_total", "缓存查询次数，result 区分内存命中、磁盘命中和未命中",
+        # cache.hits 包含磁盘命中，内存命中单独计算，各标签之和等于查询总数
+        lambda: {"hit": cache.hits - cache.disk_hits, "disk_hit": cache.disk_hits, "miss": cache.misses},
+        kind="counter", labelname="result"))
+    REGISTRY.register(Callback("pv_cache_hit_ratio", "缓存命中率", lambda: cache.stats()["hit_rate"]))
+    REGISTRY.register(Callback("pv_cache_entries", "内存缓存条目数", lambda: cache.stats()["entries"]))
+    REGISTRY.register(Callback("pv_cache_evictions_total", "缓存淘汰次数", lambda: cache.evictions, kind="counter"))
+
+
+def register_engine_metrics(engine, execution=None):
+    """动态批处理队列深度、正在执行的批次数，以及执行层的在途/拒绝请求数"""
+    REGISTRY.register(Callback("pv_queue_depth", "等待组批的请求数", lambda: engine.queue_depth))
+    REGISTRY.register(Callback("pv_running_batches", "正在推理的批次数", lambda: engine.stats()["running_batches"]))
+    if execution is not None:
+        REGISTRY.register(Callback("pv_inflight_requests", "正在处理的请求数", lambda: execution.pending))
+        REGISTRY.register(Callback("pv_rejected_requests_total", "因过载被拒绝的请求数",
+                                   lambda: execution.rejected, kind="counter"))
+
+
+def render():
+    return REGISTRY.render()
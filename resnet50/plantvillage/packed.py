@@ -0,0 +1,117 @@
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from torchvision.datasets import ImageFolder
+
+from .preprocess import INPUT_SIZE
+
+# 打包后每个数据划分对应三个文件：<split>.images.npy、<split>.labels.npy、<split>.index.json
+
+
+def split_paths(out_dir, split):
+    prefix = os.path.join(out_dir, split)
+    return prefix + ".images.npy", prefix + ".labels.npy", prefix + ".index.json"
+
+
+def decode_resized(path, size=INPUT_SIZE):
+    """与训练时的 Resize((224, 224)) 相同：PIL 双线性缩放，返回 uint8 数组 (H, W, 3)"""
+    with Image.open(path) as image:
+        return np.asarray(image.convert("RGB").resize((size, size), Image.BILINEAR))
+
+
+_images = None
+
+
+def _init_worker(images_path):
+    # 每个子进程只打开一次 memmap，直接把结果写进输出文件，不经过进程间管道传输像素
+    global _images
+    _images = np.load(images_path, mmap_mode="r+")
+
+
+def _pack_one(task):
+    index, path = task
+    try:
+        _images[index] = decode_resized(path, _images.shape[1])
+        return index, None
+    except Exception as e:
+        return index, f"{path}: {e}"
+
+
+def pack_split(root, out_dir, split, size=INPUT_SIZE, workers=None, progress=None):
+    """把 ImageFolder 目录一次性解码、缩放并打包成 uint8 数组 (N, size, size, 3)，返回出错的文件列表"""
+    folder = ImageFolder(os.path.join(root, split))
+    images_path, labels_path, index_path = split_paths(out_dir, split)
+    os.makedirs(out_dir, exist_ok=True)
+    images = np.lib.format.open_memmap(images_path, mode="w+", dtype=np.uint8,
+                                       shape=(len(folder.samples), size, size, 3))
+    del images  # 只创建文件头和空间，由子进程写入
+
+    labels = np.array(folder.targets, dtype=np.int64)
+    errors = []
+    tasks = [(i, path) for i, (path, _) in enumerate(folder.samples)]
+    with Pool(workers, initializer=_init_worker, initargs=(images_path,)) as pool:
+        for done, (index, error) in enumerate(pool.imap_unordered(_pack_one, tasks, chunksize=64), start=1):
+            if error:
+                labels[index] = -1  # 读取失败的样本标记为 -1，加载时跳过
+                errors.append(error)
+            if progress is not None:
+                progress(done, len(tasks))
+    np.save(labels_path, labels)
+
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "split": split,
+            "size": size,
+            "count": len(folder.samples),
+            "classes": folder.classes,
+            "class_to_idx": folder.class_to_idx,
+            "paths": [os.path.relpath(path, root) for path, _ in folder.samples],
+        }, f, ensure_ascii=False)
+    return errors
+
+
+class PackedDataset(Dataset):
+    """读取 pack_split 生成的内存映射文件；每个样本返回 uint8 张量 (3, H, W) 和标签
+
+    数组以写时复制方式映射，取样本不拷贝数据，多个 DataLoader 进程共享同一份页缓存。
+    归一化请在拼批后调用 plantvillage.preprocess.normalize 统一完成。
+    """
+
+    def __init__(self, out_dir, split, transform=None):
+        self.images_path, self.labels_path, index_path = split_paths(out_dir, split)
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        self.classes = index["classes"]
+        self.class_to_idx = index["class_to_idx"]
+        self.paths = index["paths"]
+        labels = np.load(self.labels_path)
+        self.indices = np.flatnonzero(labels >= 0)  # 跳过打包时读取失败的样本
+        self.targets = labels[self.indices]
+        self.transform = transform
+        self._images = None
+
+    def __len__(self):
+        return len(self.targets)
+
+    @property
+    def images(self):
+        # 延迟到 DataLoader 子进程中再打开映射，避免把映射对象序列化给子进程
+        if self._images is None:
+            self._images = np.load(self.images_path, mmap_mode="c")
+        return self._images
+
+    def __getitem__(self, index):
+        image = torch.from_numpy(self.images[self.indices[index]]).permute(2, 0, 1)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, int(self.targets[index])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
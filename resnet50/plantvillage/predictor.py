@@ -0,0 +1,126 @@
+import threading
+
+import numpy as np
+import torch
+
+from . import config
+from .labels import PLANT_LIST, build_class_index
+from .metrics import BATCH_SIZE, stage_timer
+from .preprocess import normalize, preprocess
+from .runtime import load_model, run_model
+
+
+class Predictor:
+    """植物病害预测器：首次使用时才加载模型，之后在进程内复用"""
+
+    def __init__(self, model_path=None, device=None, class_to_idx=None):
+        self.model_path = model_path or config.MODEL_PATH
+        self._device = device
+        self._model = None
+        self.metadata = {}
+        self._class_to_idx = class_to_idx
+        self._set_class_index(class_to_idx)
+        self._class_index_tensor = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """加载模型（线程安全，只加载一次）；服务端可在启动时主动调用以完成预热"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model, self._device, self.metadata = load_model(self.model_path, self._device)
+                    if self._class_to_idx is None:
+                        # 新格式的模型文件自带训练时的类别映射
+                        self._set_class_index(self.metadata.get("class_to_idx"))
+                    self._class_index_tensor = torch.from_numpy(self.class_index).to(self._device)
+        return self
+
+    def _set_class_index(self, class_to_idx):
+        # 模型输出下标 -> 类别编号 / 名称，class_to_idx 取自训练时的 ImageFolder
+        self.class_index = build_class_index(class_to_idx)
+        self.class_names = np.array(PLANT_LIST, dtype=object)[self.class_index]
+
+    @property
+    def model(self):
+        self.load()
+        return self._model
+
+    @property
+    def model_version(self):
+        """已加载模型的标识（权重哈希），预测缓存按它隔离"""
+        self.load()
+        return self.metadata.get("hash")
+
+    @property
+    def device(self):
+        self.load()
+        return self._device
+
+    def preprocess(self, image):
+        return preprocess(image)
+
+    def postprocess(self, outputs, top_k=1):
+        """一次 softmax + topk 得到整批的前 k 个类别编号、名称和概率，形状均为 (N, k)
+
+        全程向量化，没有逐元素的 Python 循环。
+        """
+        top_k = min(top_k, outputs.shape[1])
+        confidences, predicted = torch.softmax(outputs, dim=1).topk(top_k, dim=1)
+        class_ids = self._class_index_tensor[predicted]
+        predicted = predicted.cpu().numpy()
+        return {
+            "class_id": class_ids.cpu().numpy(),
+            "class_name": self.class_names[predicted],
+            "confidence": confidences.cpu().numpy(),
+        }
+
+    def predict_tensors(self, tensors, top_k=1):
+        """对已预处理的批次 (N, 3, 224, 224)（uint8 或归一化后的 float）做一次前向推理，返回 N 个结果
+
+        top_k 可以是整数，也可以是与批次等长的列表（动态批处理时每个请求的 k 不同），
+        此时按最大的 k 计算一次，再分别截断。
+        """
+        top_ks = list(top_k) if isinstance(top_k, (list, tuple)) else [top_k] * len(tensors)
+        top_ks = [k or 1 for k in top_ks]
+        BATCH_SIZE.observe(len(tensors))
+        # 拷贝到设备和整批归一化计入 forward；GPU 上前向是异步的，同步等待落在 postprocess 的 .cpu() 中
+        with stage_timer("forward"):
+            tensors = tensors.to(self.device)
+            if tensors.dtype == torch.uint8:
+                # 快速解码得到的是 uint8，拷到设备后再整批归一化
+                tensors = normalize(tensors)
+            outputs = run_model(self.model, tensors)
+        with stage_timer("postprocess"):
+            batch = self.postprocess(outputs, max(top_ks))
+            results = []
+            for k, class_ids, class_names, confidences in zip(
+                    top_ks, batch["class_id"].tolist(), batch["class_name"].tolist(), batch["confidence"].tolist()):
+                predictions = [
+                    {"class_id": class_id, "class_name": class_name, "confidence": confidence}
+                    for class_id, class_name, confidence in zip(class_ids[:k], class_names[:k], confidences[:k])
+                ]
+                # 顶层保留 top-1 字段，兼容只读 class_name/confidence 的客户端
+                results.append(dict(predictions[0], predictions=predictions))
+        return results
+
+    def predict_batch(self, images, top_k=1):
+        """images 可以是图片字节、文件路径或 PIL 图像的列表"""
+        if not images:
+            return []
+        return self.predict_tensors(torch.stack([self.preprocess(image) for image in images]), top_k)
+
+    def predict_one(self, image, top_k=1):
+        return self.predict_batch([image], top_k)[0]
+
+
+_predictors = {}
+_predictors_lock = threading.Lock()
+
+
+def get_predictor(model_path=None):
+    """每个进程、每个模型文件只创建一个 Predictor"""
+    model_path = model_path or config.MODEL_PATH
+    with _predictors_lock:
+        if model_path not in _predictors:
+            _predictors[model_path] = Predictor(model_path)
+        return _predictors[model_path]
@@ -0,0 +1,78 @@
+import io
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+from . import config
+from .metrics import stage_timer
+
+# 训练和推理共用的输入尺寸与归一化参数
+INPUT_SIZE = 224
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+# 与 train.py 训练时完全一致：直接缩放到 224x224（不做中心裁剪）
+TRANSFORM = transforms.Compose([
+    transforms.Resize((INPUT_SIZE, INPUT_SIZE)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=MEAN, std=STD),
+])
+
+_MEAN = torch.tensor(MEAN).view(1, 3, 1, 1) * 255
+_STD = torch.tensor(STD).view(1, 3, 1, 1) * 255
+
+
+def load_image(source, draft_size=None):
+    """把图片字节、文件路径或 PIL 图像统一成 RGB 的 PIL 图像
+
+    指定 draft_size 时，JPEG 在解码阶段直接按 1/2、1/4、1/8 缩小（DCT 域降采样），
+    保证宽高都不小于 draft_size，手机拍摄的大图解码耗时可降低一个数量级。
+    """
+    if isinstance(source, Image.Image):
+        image = source
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(source))
+    else:
+        image = Image.open(source)
+    if draft_size and image.format == "JPEG":
+        image.draft("RGB", (draft_size, draft_size))
+    return image.convert("RGB")
+
+
+def to_uint8_tensor(image):
+    """缩放到 224x224 后直接转成 uint8 张量 (3, 224, 224)，不经过 float 中间结果"""
+    if image.size != (INPUT_SIZE, INPUT_SIZE):
+        image = image.resize((INPUT_SIZE, INPUT_SIZE), Image.BILINEAR)
+    # permute 只改变步长不拷贝数据，拼批时 torch.stack 才做唯一一次连续化拷贝
+    return torch.from_numpy(np.array(image)).permute(2, 0, 1)
+
+
+def normalize(tensors):
+    """对整批 uint8 张量 (N, 3, H, W) 做归一化，结果与 ToTensor + Normalize 相同"""
+    mean = _MEAN.to(tensors.device)
+    std = _STD.to(tensors.device)
+    return (tensors.float() - mean) / std
+
+
+def _decode(source, draft_size=None):
+    if isinstance(source, Image.Image):
+        # 已经解码过（例如缓存为计算哈希先行解码），不再计入 decode 阶段
+        return load_image(source, draft_size)
+    with stage_timer("decode"):
+        return load_image(source, draft_size)
+
+
+def preprocess(source):
+    """返回单张图像的输入张量 (3, 224, 224)
+
+    快速解码（默认）返回 uint8 张量，由推理线程对整批统一归一化；否则返回归一化后的 float 张量。
+    """
+    if config.FAST_DECODE:
+        image = _decode(source, INPUT_SIZE)
+        with stage_timer("transform"):
+            return to_uint8_tensor(image)
+    image = _decode(source)
+    with stage_timer("transform"):
+        return TRANSFORM(image)
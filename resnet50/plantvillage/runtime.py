@@ -0,0 +1,62 @@
+import torch
+
+from . import config
+from .checkpoint import load_model_file
+
+
+def configure_threads(torch_threads=None):
+    """设置 PyTorch 线程数，保证 推理线程数 x 算子线程数 不超过核心数"""
+    torch.set_num_threads(torch_threads or config.TORCH_THREADS)
+    try:
+        # 批次间的并行已由推理线程池负责，算子间并行只会和它抢核心
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # 已经执行过并行算子后不能再修改，保持现状即可
+        pass
+
+
+def get_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def freeze_model(model, device, input_size=224):
+    """切换到推理模式并冻结参数，不再为任何请求构建计算图"""
+    model.eval()
+    model.requires_grad_(False)
+    if config.JIT_FREEZE:
+        # 可选：TorchScript 冻结，把 BN 折叠进卷积并把参数变为常量
+        example = torch.zeros(1, 3, input_size, input_size, device=device)
+        with torch.inference_mode():
+            model = torch.jit.freeze(torch.jit.trace(model, example))
+    return model
+
+
+def warmup(model, device, batch_sizes=None, input_size=224):
+    """启动时先跑几次前向，让内存分配、算子选择等惰性初始化不落在第一个真实请求上"""
+    batch_sizes = batch_sizes or sorted({1, config.MAX_BATCH_SIZE})
+    with torch.inference_mode():
+        for batch_size in batch_sizes:
+            dummy = torch.zeros(batch_size, 3, input_size, input_size, device=device)
+            for _ in range(config.WARMUP_ITERS):
+                model(dummy)
+
+
+def load_model(path=None, device=None):
+    """加载训练好的模型并完成推理前的全部准备：线程设置、冻结、预热
+
+    返回 (模型, 设备, 元数据)，元数据（类别映射、权重哈希）在加载时一并读出，不必再读一次文件。
+    """
+    configure_threads()
+    device = device or get_device()
+    # 部署格式只读取权重，不反序列化模型对象；旧版整模型文件自动兼容。
+    # 权重读入内存后不再占用文件，训练可以在服务运行时覆盖模型文件
+    model, meta = load_model_file(path or config.MODEL_PATH, device)
+    model = freeze_model(model, device)
+    warmup(model, device)
+    return model, device, meta
+
+
+def run_model(model, tensors):
+    """不记录梯度的前向推理"""
+    with torch.inference_mode():
+        return model(tensors)
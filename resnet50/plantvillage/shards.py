@@ -0,0 +1,140 @@
+import io
+import json
+import os
+import random
+import tarfile
+
+from torch.utils.data import IterableDataset, get_worker_info
+
+from .preprocess import load_image, to_uint8_tensor
+
+# 分片格式与 WebDataset 相同：每个样本在 tar 中连续存放 <key>.jpg 和 <key>.cls（类别目录名）
+# 输出目录下的 shards.json 记录每个划分的分片列表和各类别样本数
+
+SHARD_INDEX = "shards.json"
+
+
+class ShardWriter:
+    """顺序写入一个 tar 分片；先写临时文件，close 时再改名，中断不会留下半个分片"""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.count = 0
+        self._tar = tarfile.open(self.tmp_path, "w")
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def add(self, key, jpeg_bytes, class_name):
+        self._add_member(f"{key}.jpg", jpeg_bytes)
+        self._add_member(f"{key}.cls", str(class_name).encode("utf-8"))
+        self.count += 1
+
+    def close(self):
+        self._tar.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def write_index(out_dir, split_records):
+    """split_records: {划分: {"shards": [...], "class_counts": {类别: 数量}}}"""
+    # 全部划分共用一份类别表，某个划分缺少个别类别时标签编号也保持一致
+    classes = sorted({str(name) for record in split_records.values() for name in record["class_counts"]})
+    index = {"classes": classes}
+    for split, record in split_records.items():
+        counts = record["class_counts"]
+        index[split] = {
+            "shards": sorted(record["shards"]),
+            "class_counts": dict(sorted(counts.items(), key=lambda item: str(item[0]))),
+            "count": sum(counts.values()),
+        }
+    with open(os.path.join(out_dir, SHARD_INDEX), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+
+
+def iter_tar_samples(path):
+    """以流式顺序读取一个分片，按 key 把 .jpg 和 .cls 组合成 (图片字节, 类别名)"""
+    current_key, sample = None, {}
+    with tarfile.open(path, "r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, _, ext = member.name.rpartition(".")
+            if key != current_key:
+                if "jpg" in sample and "cls" in sample:
+                    yield sample["jpg"], sample["cls"]
+                current_key, sample = key, {}
+            sample[ext] = tar.extractfile(member).read()
+    if "jpg" in sample and "cls" in sample:
+        yield sample["jpg"], sample["cls"]
+
+
+class ShardDataset(IterableDataset):
+    """流式读取分片的数据集：分片按 DataLoader 子进程切分、顺序读取，再经过洗牌缓冲区打乱
+
+    与 PackedDataset 一样返回 uint8 张量 (3, 224, 224) 和 ImageFolder 规则的标签下标，
+    归一化请在拼批后调用 plantvillage.preprocess.normalize。
+    """
+
+    def __init__(self, out_dir, split, shuffle=False, shuffle_buffer=1000, seed=42, transform=None):
+        with open(os.path.join(out_dir, SHARD_INDEX), encoding="utf-8") as f:
+            index = json.load(f)
+        classes = index["classes"]
+        index = index[split]
+        self.shards = [os.path.join(out_dir, name) for name in index["shards"]]
+        self.count = index["count"]
+        # 与 ImageFolder 一致：类别目录名按字符串排序后编号
+        self.classes = classes
+        self.class_to_idx = {name: idx for idx, name in enumerate(self.classes)}
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.transform = transform
+        self.epoch = 0
+
+    def __len__(self):
+        return self.count
+
+    def set_epoch(self, epoch):
+        """每个 epoch 开始前由训练循环调用，决定分片顺序和洗牌种子
+
+        非常驻的 DataLoader 子进程每个 epoch 都重新拷贝数据集，只在 __iter__ 里自增的话每轮都相同。
+        """
+        self.epoch = epoch
+
+    def _samples(self, shards):
+        for path in shards:
+            for data, class_name in iter_tar_samples(path):
+                image = to_uint8_tensor(load_image(data))
+                if self.transform is not None:
+                    image = self.transform(image)
+                yield image, self.class_to_idx[class_name.decode("utf-8")]
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker else (0, 1)
+        epoch = self.epoch
+        # 常驻子进程中的副本收不到 set_epoch，自增保证下一轮的顺序不同
+        self.epoch += 1
+        rng = random.Random(self.seed + epoch * 1000 + worker_id)
+        shards = list(self.shards)
+        if self.shuffle:
+            random.Random(self.seed + epoch).shuffle(shards)  # 各子进程使用相同的分片顺序再切分
+        shards = shards[worker_id::num_workers]
+        samples = self._samples(shards)
+        if not self.shuffle or self.shuffle_buffer <= 1:
+            yield from samples
+            return
+        # 洗牌缓冲区：缓冲区满后每读入一个样本，随机换出一个
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            i = rng.randrange(len(buffer))
+            buffer[i], sample = sample, buffer[i]
+            yield sample
+        rng.shuffle(buffer)
+        yield from buffer
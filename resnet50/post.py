@@ -1,6 +1,294 @@
-import requests
+# 预测服务压测客户端：异步并发 + 连接池，开环/闭环两种模式，回放图片目录，输出延迟直方图
+# 用法：
+#   单次请求（原来的用法）：python post.py
+#   闭环：python post.py --url http://127.0.0.1:5000/predict --images E:/wjx/py/mydata/test --concurrency 16 --duration 60
+#   开环：python post.py --url http://127.0.0.1:5000/predict --images E:/wjx/py/mydata/test --mode open --rps 50 --duration 60
+# 开环模式按计划时间发送请求，延迟从计划发送时刻算起，服务端变慢时排队的时间也计入（协调遗漏修正）；
+# 错误率超过 --max-error-rate 时以非零状态码退出，可以直接用在部署前的容量评估脚本里。
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
 
-resp = requests.post("http://192.168.1.110:6666/predict",
-                     files={"file": open('APAS_image (5)_16_0.jpg','rb')})
+import httpx
 
-print(resp.json())
\ No newline at end of file
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图，相对误差约为 precision，记录任意多个样本内存都不变"""
+
+    def __init__(self, precision=0.01):
+        self.base = math.log1p(precision)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value, count=1):
+        value = max(value, 1e-6)
+        # 向下取整：亚秒级延迟的对数为负，int() 向零取整会把它们归入高一档的桶
+        index = math.floor(math.log(value) / self.base)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.max = max(self.max, value)
+
+    def record_corrected(self, value, expected_interval):
+        """协调遗漏修正：一个请求慢到超过发送间隔时，补记被它"挡住"的那些请求本应经历的延迟"""
+        self.record(value)
+        if expected_interval and expected_interval > 0:
+            missing = value - expected_interval
+            while missing >= expected_interval:
+                self.record(missing)
+                missing -= expected_interval
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        threshold = self.count * p / 100
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= threshold:
+                return min(math.exp((index + 1) * self.base), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            **{f"p{p}_ms": round(self.percentile(p) * 1000, 2) for p in (50, 90, 95, 99, 99.9)},
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+    def render(self, width=40):
+        """终端里的文字直方图，按 2 倍宽度合并桶"""
+        if not self.count:
+            return ""
+        merged = {}
+        for index, count in self.buckets.items():
+            upper = 2 ** math.ceil(math.log2(math.exp((index + 1) * self.base) * 1000))
+            merged[upper] = merged.get(upper, 0) + count
+        peak = max(merged.values())
+        lines = []
+        for upper in sorted(merged):
+            bar = "#" * max(1, round(merged[upper] / peak * width))
+            lines.append(f"{'<= ' + str(upper) + 'ms':>12} {merged[upper]:>8} {bar}")
+        return "\n".join(lines)
+
+
+def validate(response):
+    """检查响应格式，返回错误类型；格式正确返回 None"""
+    if response.status_code != 200:
+        return f"http_{response.status_code}"
+    try:
+        body = response.json()
+    except ValueError:
+        return "invalid_json"
+    if not isinstance(body, dict) or "error" in body:
+        return "server_error"
+    if not isinstance(body.get("class_name"), str) or not isinstance(body.get("confidence"), (int, float)):
+        return "schema"
+    if not 0 <= body["confidence"] <= 1:
+        return "schema"
+    predictions = body.get("predictions")
+    if predictions is not None:
+        if not isinstance(predictions, list) or not predictions:
+            return "schema"
+        for item in predictions:
+            if not isinstance(item, dict) or not {"class_id", "class_name", "confidence"} <= item.keys():
+                return "schema"
+    return None
+
+
+def load_images(path):
+    """单个文件或目录（递归）中的全部图片，预先读入内存，压测时不受磁盘影响"""
+    if os.path.isfile(path):
+        paths = [path]
+    else:
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(path) for name in names
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    if not paths:
+        raise SystemExit(f"{path} 中没有图片")
+    images = []
+    for image_path in paths:
+        with open(image_path, "rb") as f:
+            images.append((os.path.basename(image_path), f.read()))
+    return images
+
+
+class LoadGenerator:
+    def __init__(self, args, images):
+        self.args = args
+        self.images = images
+        self.corrected = LatencyHistogram()  # 从计划发送时刻算起（含客户端排队）
+        self.service = LatencyHistogram()  # 从实际发出请求算起
+        self.errors = {}
+        self.sent = 0
+        self.example = None
+
+    async def send(self, client, index, scheduled, expected_interval=None):
+        name, data = self.images[index % len(self.images)]
+        self.sent += 1
+        started = time.perf_counter()
+        try:
+            response = await client.post(self.args.url, files={"file": (name, data, "image/jpeg")},
+                                         params={"top_k": self.args.top_k})
+            error = validate(response)
+        except httpx.HTTPError as e:
+            error = type(e).__name__
+        finished = time.perf_counter()
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+            return
+        if self.example is None:
+            self.example = response.json()
+        self.service.record(finished - started)
+        if expected_interval is None:
+            self.corrected.record(finished - scheduled)
+        else:
+            self.corrected.record_corrected(finished - scheduled, expected_interval)
+
+    def schedule(self, start):
+        """开环模式的计划发送时刻：均匀间隔，或 --poisson 时为泊松到达"""
+        interval = 1 / self.args.rps
+        at = start
+        for index in range(self.total_requests()):
+            yield index, at
+            at += random.expovariate(self.args.rps) if self.args.poisson else interval
+
+    def total_requests(self):
+        if self.args.requests:
+            return self.args.requests
+        if self.args.mode == "open":
+            return max(1, int(self.args.rps * self.args.duration))
+        return sys.maxsize
+
+    async def run_open(self, client):
+        tasks = []
+        start = time.perf_counter()
+        for index, at in self.schedule(start):
+            delay = at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # 不等前一个请求返回，连接池用尽时请求在客户端排队，排队时间计入延迟
+            tasks.append(asyncio.create_task(self.send(client, index, at)))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+    async def run_closed(self, client):
+        start = time.perf_counter()
+        deadline = start + self.args.duration if not self.args.requests else math.inf
+        counter = iter(range(self.total_requests()))
+        # 闭环模式给定 --rps 时每个连接按 并发数/rps 的间隔发送，慢请求挡住的发送按该间隔修正
+        interval = self.args.concurrency / self.args.rps if self.args.rps else None
+
+        async def worker():
+            next_at = time.perf_counter()
+            for index in counter:
+                if time.perf_counter() >= deadline:
+                    return
+                if interval:
+                    delay = next_at - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                scheduled = time.perf_counter()
+                if interval:
+                    next_at = scheduled + interval
+                await self.send(client, index, scheduled, interval)
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        return time.perf_counter() - start
+
+    def pool_size(self):
+        """连接池大小：闭环默认等于并发数；开环默认 rps × 超时，即超时前最多同时在途的请求数"""
+        if self.args.connections:
+            return self.args.connections
+        if self.args.mode == "open":
+            return max(1, math.ceil(self.args.rps * self.args.timeout))
+        return self.args.concurrency
+
+    async def run(self):
+        connections = self.pool_size()
+        limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        timeout = httpx.Timeout(self.args.timeout)
+        async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+            if self.args.mode == "open":
+                return await self.run_open(client)
+            return await self.run_closed(client)
+
+    def report(self, elapsed):
+        failed = sum(self.errors.values())
+        return {
+            "url": self.args.url,
+            "mode": self.args.mode,
+            "target_rps": self.args.rps,
+            "concurrency": self.args.concurrency,
+            "connections": self.pool_size(),
+            "images": len(self.images),
+            "sent": self.sent,
+            "ok": self.service.count,
+            "errors": self.errors,
+            "error_rate": round(failed / self.sent, 4) if self.sent else 0.0,
+            "elapsed_s": round(elapsed, 2),
+            "achieved_rps": round(self.sent / elapsed, 2) if elapsed else 0.0,
+            "latency": self.corrected.summary(),
+            "service_time": self.service.summary(),
+        }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="预测服务压测客户端")
+    parser.add_argument("--url", default="http://192.168.1.110:6666/predict")
+    parser.add_argument("--images", default="APAS_image (5)_16_0.jpg", help="图片文件或目录，按顺序循环回放")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed",
+                        help="closed：固定并发，收到响应再发下一个；open：按 --rps 计划发送，不等响应")
+    parser.add_argument("--concurrency", type=int, default=1, help="闭环模式的并发数")
+    parser.add_argument("--connections", type=int, default=None, help="连接池大小，闭环默认等于并发数，开环默认 rps × 超时")
+    parser.add_argument("--rps", type=float, default=None, help="目标每秒请求数（开环模式必填）")
+    parser.add_argument("--poisson", action="store_true", help="开环模式按泊松过程发送，而不是均匀间隔")
+    parser.add_argument("--duration", type=float, default=10.0, help="压测时长（秒）")
+    parser.add_argument("--requests", type=int, default=None, help="请求总数，指定后忽略 --duration")
+    parser.add_argument("--top-k", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30.0, help="单个请求的超时（秒）")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="错误率超过该值时以状态码 1 退出")
+    parser.add_argument("--json", default=None, help="把结果另存为 JSON 文件")
+    parser.add_argument("--histogram", action="store_true", help="打印延迟直方图")
+    args = parser.parse_args()
+    if args.mode == "open" and not args.rps:
+        parser.error("开环模式需要指定 --rps")
+    if len(sys.argv) == 1:
+        # 不带参数时保持原来的行为：发送一张图片并打印结果
+        args.requests = 1
+    return args
+
+
+def main():
+    args = parse_args()
+    generator = LoadGenerator(args, load_images(args.images))
+    elapsed = asyncio.run(generator.run())
+    report = generator.report(elapsed)
+
+    if args.requests == 1 and generator.example is not None:
+        print(generator.example)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.histogram:
+        print(generator.corrected.render())
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if report["error_rate"] > args.max_error_rate:
+        print(f"❌ 错误率 {report['error_rate']:.2%} 超过阈值 {args.max_error_rate:.2%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
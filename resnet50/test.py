@@ -1,26 +1,35 @@
+import argparse
+import os
 import torch
 import torchvision
 from torch.utils.data import DataLoader
-from torchvision import transforms, models
-
-# 直接加载整个模型
-model = torch.load("best_resnet50.pth")
-model.eval()  # 切换到评估模式
-
-device = torch.device("cuda") 
-model.to(device)
-
-# 数据预处理
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
-
-test_dataset = torchvision.datasets.ImageFolder(
-    root="E:/wjx/py/mydata/plantvillage_splitted/test",
-    transform=transform
-)
+
+from plantvillage.packed import PackedDataset
+from plantvillage.preprocess import TRANSFORM, normalize
+from plantvillage.runtime import load_model
+from plantvillage.shards import ShardDataset
+
+parser = argparse.ArgumentParser(description="在测试集上评估模型")
+parser.add_argument("--data", default="E:/wjx/py/mydata/plantvillage_splitted", help="ImageFolder 格式的数据集根目录")
+parser.add_argument("--packed", default=None, help="pack_dataset.py 生成的打包目录")
+parser.add_argument("--shards", default=None, help="imgdata_yolo2resnet50.py --format shards 生成的分片目录")
+args = parser.parse_args()
+
+# 按 state_dict 构建并加载模型（已冻结参数并切换到评估模式）
+model, device, _ = load_model()
+
+# 数据预处理，与训练、服务端一致
+transform = TRANSFORM
+
+if args.packed:
+    test_dataset = PackedDataset(args.packed, "test")
+elif args.shards:
+    test_dataset = ShardDataset(args.shards, "test")
+else:
+    test_dataset = torchvision.datasets.ImageFolder(
+        root=os.path.join(args.data, "test"),
+        transform=transform
+    )
 test_loader = DataLoader(test_dataset, batch_size=32, shuffle=False)
 
 correct = 0
@@ -31,6 +40,8 @@ running_loss = 0.0
 with torch.no_grad():  # 评估时不需要计算梯度
     for images, labels in test_loader:
         images, labels = images.to(device), labels.to(device)  # 确保数据和模型在同一设备上
+        if images.dtype == torch.uint8:
+            images = normalize(images)  # 打包数据集返回 uint8，在设备上统一归一化
 
         outputs = model(images)  # 获取模型输出
         _, predicted = torch.max(outputs, 1)  # 获取最大概率的类别
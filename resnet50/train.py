@@ -1,15 +1,21 @@
 import os
+import sys
+import argparse
 import torch
 import torchvision
-import torchvision.transforms as transforms
 from torchvision import models
-from torch.utils.data import DataLoader
 import torch.nn as nn
 import torch.optim as optim
 from torch.utils.tensorboard import SummaryWriter
 import torch.optim.lr_scheduler as lr_scheduler
 import numpy as np
 
+from plantvillage.checkpoint import export_model, load_checkpoint, load_model_file, save_checkpoint
+from plantvillage.data import LoaderTimer, loader_config, make_loader, subsample
+from plantvillage.packed import PackedDataset
+from plantvillage.preprocess import TRANSFORM, normalize
+from plantvillage.shards import ShardDataset
+
 # 设置 TORCH_HOME
 os.environ['TORCH_HOME'] = 'E:/wjx/py/resnet50'  # 自定义缓存路径
 
@@ -19,36 +25,8 @@ lr = 0.001
 num_epochs = 50
 patience = 5  # Early Stopping的耐心值
 
-# 数据预处理
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
-
-# 加载数据集
-train_dataset = torchvision.datasets.ImageFolder(root="E:/wjx/py/mydata/plantvillage_splitted/train",transform=transform)
-val_dataset = torchvision.datasets.ImageFolder(root="E:/wjx/py/mydata/plantvillage_splitted/val",transform=transform)
-test_dataset = torchvision.datasets.ImageFolder(root="E:/wjx/py/mydata/plantvillage_splitted/test",transform=transform)
-
-train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False)
-test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
-
-# 加载ResNet50
-device = torch.device("cuda")
-model = models.resnet50(pretrained=True)
-num_ftrs = model.fc.in_features
-model.fc = nn.Linear(num_ftrs, len(train_dataset.classes))
-model = model.to(device)
-
-# 损失函数和优化器
-criterion = nn.CrossEntropyLoss()
-optimizer = optim.Adam(model.parameters(), lr=lr, weight_decay=1e-4)  # 增加 L2 正则化
-
-# 学习率调度器（ReduceLROnPlateau）
-scheduler = lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', factor=0.5, patience=3)
-
+# 数据预处理，与推理服务共用同一套定义
+transform = TRANSFORM
 
 # Early Stopping 类
 class EarlyStopping:
@@ -70,81 +48,281 @@ class EarlyStopping:
             return True
         return False
 
+    def state_dict(self):
+        return {"best_loss": self.best_loss, "counter": self.counter}
+
+    def load_state_dict(self, state):
+        self.best_loss = state["best_loss"]
+        self.counter = state["counter"]
+
 
-# 初始化 Early Stopping
-early_stopping = EarlyStopping(patience=5)
+def prepare_batch(images, labels, device, channels_last=False):
+    """拷贝到设备；打包/分片数据集返回的 uint8 在设备上归一化；可选转换为 channels_last 内存格式"""
+    images = images.to(device, non_blocking=True)
+    labels = labels.to(device, non_blocking=True)
+    if images.dtype == torch.uint8:
+        images = normalize(images)
+    if channels_last:
+        images = images.contiguous(memory_format=torch.channels_last)
+    return images, labels
 
-# 创建 TensorBoard 的 writer
-writer = SummaryWriter(log_dir='./logs')
 
-# 训练循环
-best_loss = np.inf  # 记录最佳验证损失
-for epoch in range(num_epochs):
-    model.train()
-    running_loss = 0.0
-    correct = 0
+def evaluate(model, loader, criterion, device, amp_dtype=None, channels_last=False):
+    """在给定数据集上评估，返回 (平均损失, 准确率%)；amp_dtype 为 None 时以 fp32 计算
+
+    只做推理（inference_mode），损失和正确数累加在设备上，整个数据集跑完才同步一次。
+    """
+    model.eval()
     total = 0
+    batches = 0
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    with torch.inference_mode(), torch.autocast(device.type, dtype=amp_dtype or torch.float32, enabled=amp_dtype is not None):
+        for images, labels in loader:
+            images, labels = prepare_batch(images, labels, device, channels_last)
 
-    for images, labels in train_loader:
-        images, labels = images.to(device), labels.to(device)
+            outputs = model(images)
+            running_loss += criterion(outputs, labels).float()
+            correct += (outputs.argmax(1) == labels).sum()
+            total += labels.size(0)
+            batches += 1
+    return running_loss.item() / batches, 100 * correct.item() / total
 
-        optimizer.zero_grad()
-        outputs = model(images)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
 
-        running_loss += loss.item()
+def resolve_amp_dtype(name, device):
+    """混合精度类型：CPU 只支持 bf16；GPU 默认 fp16（配合梯度缩放），也可指定 bf16"""
+    if name == "auto":
+        name = "fp16" if device.type == "cuda" else "bf16"
+    return {"bf16": torch.bfloat16, "fp16": torch.float16}[name]
 
-        # 计算准确率
-        _, predicted = torch.max(outputs, 1)
-        total += labels.size(0)
-        correct += (predicted == labels).sum().item()
 
-    train_accuracy = 100 * correct / total
-    writer.add_scalar('Loss/train', running_loss / len(train_loader), epoch)
-    writer.add_scalar('Accuracy/train', train_accuracy, epoch)
+def parse_args():
+    parser = argparse.ArgumentParser(description="训练 ResNet50 植物病害分类模型")
+    parser.add_argument("--data", default="E:/wjx/py/mydata/plantvillage_splitted", help="ImageFolder 格式的数据集根目录")
+    parser.add_argument("--packed", default=None, help="pack_dataset.py 生成的打包目录，指定后不再逐张解码 JPEG")
+    parser.add_argument("--shards", default=None, help="imgdata_yolo2resnet50.py --format shards 生成的分片目录，顺序流式读取")
+    parser.add_argument("--shuffle-buffer", type=int, default=2000, help="分片数据集的洗牌缓冲区大小")
+    # 数据加载参数，不指定时按核心数和设备自动选择
+    parser.add_argument("--num-workers", type=int, default=None, help="DataLoader 子进程数")
+    parser.add_argument("--prefetch-factor", type=int, default=None, help="每个子进程预取的批次数")
+    parser.add_argument("--pin-memory", action=argparse.BooleanOptionalAction, default=None, help="是否使用锁页内存")
+    parser.add_argument("--persistent-workers", action=argparse.BooleanOptionalAction, default=None,
+                        help="子进程是否跨 epoch 常驻")
+    # 检查点：每个 epoch 结束保存一次，中断后用 --resume 从下一个 epoch 继续
+    parser.add_argument("--checkpoint", default="last_checkpoint.pth", help="训练检查点保存路径")
+    parser.add_argument("--resume", nargs="?", const="last_checkpoint.pth", default=None,
+                        help="从检查点继续训练，不指定路径时使用 last_checkpoint.pth")
+    # 验证开销：频率、快速验证抽样比例、验证批大小（只推理不反向，可以比训练批更大）
+    parser.add_argument("--val-every", type=int, default=1, help="每隔多少个 epoch 验证一次（最后一个 epoch 总会验证）")
+    parser.add_argument("--val-fraction", type=float, default=1.0,
+                        help="训练过程中只用固定抽取的这部分验证集快速验证，训练结束后再用完整验证集评估最佳模型")
+    parser.add_argument("--val-batch-size", type=int, default=batch_size * 4, help="验证批大小")
+    parser.add_argument("--init", default=None,
+                        help="从已保存的完整模型开始微调（如 train_head.py 的输出），默认使用 ImageNet 预训练权重")
+    # 快速训练模式：混合精度 + channels_last
+    parser.add_argument("--amp", action="store_true", help="启用混合精度训练（autocast）")
+    parser.add_argument("--amp-dtype", choices=["auto", "bf16", "fp16"], default="auto",
+                        help="混合精度类型，auto 时 CPU 用 bf16、GPU 用 fp16")
+    parser.add_argument("--channels-last", action="store_true", help="使用 channels_last 内存格式")
+    parser.add_argument("--fast", action="store_true", help="等价于 --amp --channels-last")
+    parser.add_argument("--fp32-baseline", type=float, default=None,
+                        help="fp32 训练得到的验证准确率(%%)；混合精度训练结束后与之比较，低于基线超过 "
+                             "--amp-tolerance 时不保留导出的模型并以状态码 1 退出。不指定时只能检查 "
+                             "同一份权重的 fp32 与混合精度推理是否一致，无法反映混合精度训练对准确率的影响")
+    parser.add_argument("--amp-tolerance", type=float, default=0.5,
+                        help="混合精度与 fp32 验证准确率允许的最大差值(百分点)")
+    args = parser.parse_args()
+    if args.fast:
+        args.amp = args.channels_last = True
+    return args
 
-    print(
-        f"Epoch [{epoch + 1}/{num_epochs}], Loss: {running_loss / len(train_loader):.4f}, Train Accuracy: {train_accuracy:.2f}%")
-    # 获取当前学习率
-    print(f"Current Learning Rate: {scheduler.optimizer.param_groups[0]['lr']}")
-    # 验证阶段
-    model.eval()
-    val_correct = 0
-    val_total = 0
-    val_loss = 0.0
-    with torch.no_grad():
-        for images, labels in val_loader:
-            images, labels = images.to(device), labels.to(device)
 
-            outputs = model(images)
-            loss = criterion(outputs, labels)
-            val_loss += loss.item()
+def main():
+    args = parse_args()
+
+    # 加载数据集
+    if args.packed:
+        # 预解码的 uint8 数组，归一化在拼批后统一完成
+        train_dataset = PackedDataset(args.packed, "train")
+        val_dataset = PackedDataset(args.packed, "val")
+        test_dataset = PackedDataset(args.packed, "test")
+    elif args.shards:
+        # tar 分片顺序读取 + 洗牌缓冲区，同样返回 uint8
+        train_dataset = ShardDataset(args.shards, "train", shuffle=True, shuffle_buffer=args.shuffle_buffer)
+        val_dataset = ShardDataset(args.shards, "val")
+        test_dataset = ShardDataset(args.shards, "test")
+    else:
+        train_dataset = torchvision.datasets.ImageFolder(root=os.path.join(args.data, "train"),transform=transform)
+        val_dataset = torchvision.datasets.ImageFolder(root=os.path.join(args.data, "val"),transform=transform)
+        test_dataset = torchvision.datasets.ImageFolder(root=os.path.join(args.data, "test"),transform=transform)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    amp_dtype = resolve_amp_dtype(args.amp_dtype, device) if args.amp else None
+    if args.amp or args.channels_last:
+        print(f"快速训练模式: autocast={amp_dtype}, channels_last={args.channels_last}")
+
+    # 多进程并行加载数据：子进程解码/变换，锁页内存 + 预取让数据拷贝与计算重叠
+    loader_cfg = loader_config(device, args.num_workers, args.pin_memory, args.prefetch_factor, args.persistent_workers)
+    print(f"DataLoader 配置: {loader_cfg}")
+    train_loader = make_loader(train_dataset, batch_size, True, loader_cfg)
+    val_loader = make_loader(val_dataset, args.val_batch_size, False, loader_cfg)
+    fast_val_loader = make_loader(subsample(val_dataset, args.val_fraction), args.val_batch_size, False, loader_cfg)
+    if args.val_fraction < 1:
+        print(f"快速验证: 使用 {len(fast_val_loader.dataset)}/{len(val_dataset)} 个验证样本")
+    test_loader = make_loader(test_dataset, batch_size, False, loader_cfg)
+
+    # 加载ResNet50
+    if args.init:
+        # 从已有模型（如 train_head.py 在特征缓存上训练出的线性层）开始全量微调
+        model, _ = load_model_file(args.init)
+    else:
+        model = models.resnet50(pretrained=True)
+        num_ftrs = model.fc.in_features
+        model.fc = nn.Linear(num_ftrs, len(train_dataset.classes))
+    model = model.to(device)
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    # 损失函数和优化器
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=lr, weight_decay=1e-4)  # 增加 L2 正则化
+
+    # 学习率调度器（ReduceLROnPlateau）
+    scheduler = lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', factor=0.5, patience=3)
+
+    # fp16 需要梯度缩放防止下溢；bf16 与 fp32 指数范围相同，不需要缩放
+    scaler = torch.amp.GradScaler(device.type, enabled=amp_dtype == torch.float16)
+
+
+    # 初始化 Early Stopping
+    early_stopping = EarlyStopping(patience=5)
+
+    # 创建 TensorBoard 的 writer
+    writer = SummaryWriter(log_dir='./logs')
+
+    class_to_idx = train_dataset.class_to_idx
+    best_loss = np.inf  # 记录最佳验证损失
+    start_epoch = 0
+    if args.resume:
+        checkpoint = load_checkpoint(args.resume)
+        if checkpoint["class_to_idx"] != class_to_idx:
+            raise ValueError("检查点的类别映射与当前数据集不一致，无法继续训练")
+        model.load_state_dict(checkpoint["state_dict"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        scheduler.load_state_dict(checkpoint["scheduler"])
+        if checkpoint["scaler"] is not None:
+            scaler.load_state_dict(checkpoint["scaler"])
+        early_stopping.load_state_dict(checkpoint["early_stopping"])
+        best_loss = checkpoint["best_loss"]
+        start_epoch = checkpoint["epoch"] + 1
+        print(f"从 {args.resume} 恢复，继续第 {start_epoch + 1} 个 epoch")
+
+    # 训练结束后的评估按最后完成的 epoch 记录；恢复一个已经训练完的检查点时循环一次也不执行
+    epoch = start_epoch - 1
+
+    # 训练循环
+    for epoch in range(start_epoch, num_epochs):
+        if hasattr(train_dataset, "set_epoch"):
+            # 分片数据集按 epoch 决定分片顺序和洗牌种子
+            train_dataset.set_epoch(epoch)
+        model.train()
+        # 损失和正确数累加在设备上，epoch 结束时才读回，训练循环中没有逐步的主机同步
+        running_loss = torch.zeros((), device=device)
+        correct = torch.zeros((), dtype=torch.long, device=device)
+        total = 0
+
+        timer = LoaderTimer()
+        for images, labels in timer.wrap(train_loader):
+            images, labels = prepare_batch(images, labels, device, args.channels_last)
+
+            optimizer.zero_grad()
+            with torch.autocast(device.type, dtype=amp_dtype or torch.float32, enabled=amp_dtype is not None):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+
+            running_loss += loss.detach().float()
+
+            # 计算准确率
+            correct += (outputs.argmax(1) == labels).sum()
+            total += labels.size(0)
+
+        train_loss = running_loss.item() / timer.batches
+        train_accuracy = 100 * correct.item() / total
+        writer.add_scalar('Loss/train', train_loss, epoch)
+        writer.add_scalar('Accuracy/train', train_accuracy, epoch)
+        writer.add_scalar('Time/data_wait', timer.data_time, epoch)
+        writer.add_scalar('Time/compute', timer.compute_time, epoch)
+        throughput = total / (timer.data_time + timer.compute_time)
+        writer.add_scalar('Throughput/train_images_per_sec', throughput, epoch)
+
+        print(
+            f"Epoch [{epoch + 1}/{num_epochs}], Loss: {train_loss:.4f}, Train Accuracy: {train_accuracy:.2f}%")
+        print(f"Data Loading: {timer.summary()}, Throughput: {throughput:.1f} images/s")
+        # 获取当前学习率
+        print(f"Current Learning Rate: {scheduler.optimizer.param_groups[0]['lr']}")
+        # 验证阶段：按 --val-every 跳过部分 epoch，调度器和 Early Stopping 只在验证后更新
+        stop = False
+        if (epoch + 1) % args.val_every == 0 or epoch + 1 == num_epochs:
+            val_loss, val_accuracy = evaluate(model, fast_val_loader, criterion, device, amp_dtype, args.channels_last)
+            writer.add_scalar('Loss/val', val_loss, epoch)
+            writer.add_scalar('Accuracy/val', val_accuracy, epoch)
+
+            print(f"Validation Loss: {val_loss:.4f}, Validation Accuracy: {val_accuracy:.2f}%")
+
+            # ReduceLROnPlateau 调整学习率
+            scheduler.step(val_loss)
 
-            _, predicted = torch.max(outputs, 1)
-            val_total += labels.size(0)
-            val_correct += (predicted == labels).sum().item()
+            # 保存最佳模型
+            if val_loss < best_loss:
+                best_loss = val_loss
+                export_model(model, class_to_idx, "best_resnet50.pth")
+                print("Best model saved!")
 
-    val_accuracy = 100 * val_correct / val_total
-    writer.add_scalar('Loss/val', val_loss / len(val_loader), epoch)
-    writer.add_scalar('Accuracy/val', val_accuracy, epoch)
+            # 检查 Early Stopping 条件，保存检查点后再决定是否终止
+            stop = early_stopping.step(val_loss)
+        save_checkpoint(args.checkpoint, model, class_to_idx, optimizer, scheduler, early_stopping,
+                        epoch, best_loss, scaler)
+        if stop:
+            break  # 终止训练
 
-    print(f"Validation Loss: {val_loss / len(val_loader):.4f}, Validation Accuracy: {val_accuracy:.2f}%")
 
-    # ReduceLROnPlateau 调整学习率
-    scheduler.step(val_loss)
+    if args.val_fraction < 1:
+        # 快速验证只看了部分样本，最后用完整验证集评估一次最佳模型
+        best_model, _ = load_model_file("best_resnet50.pth", device)
+        full_loss, full_accuracy = evaluate(best_model, val_loader, criterion, device, amp_dtype, args.channels_last)
+        writer.add_scalar('Accuracy/val_best_full', full_accuracy, epoch)
+        print(f"最佳模型完整验证集: Loss: {full_loss:.4f}, Accuracy: {full_accuracy:.2f}%")
 
-    # 保存最佳模型
-    if val_loss < best_loss:
-        best_loss = val_loss
-        torch.save(model, "best_resnet50.pth")
-        print("Best model saved!")
+    if amp_dtype is not None:
+        # 正确性检查：最佳模型分别以 fp32 和混合精度评估验证集，并与 fp32 训练的基线比较
+        best_model, _ = load_model_file("best_resnet50.pth", device)
+        _, fp32_accuracy = evaluate(best_model, val_loader, criterion, device, None, args.channels_last)
+        _, amp_accuracy = evaluate(best_model, val_loader, criterion, device, amp_dtype, args.channels_last)
+        writer.add_scalar('Accuracy/val_best_fp32', fp32_accuracy, epoch)
+        writer.add_scalar('Accuracy/val_best_amp', amp_accuracy, epoch)
+        print(f"最佳模型验证准确率: fp32 {fp32_accuracy:.2f}%, 混合精度 {amp_accuracy:.2f}%")
+        if abs(fp32_accuracy - amp_accuracy) > args.amp_tolerance:
+            print(f"⚠️ 混合精度推理与 fp32 相差超过 {args.amp_tolerance} 个百分点")
+        if args.fp32_baseline is None:
+            print("⚠️ 未指定 --fp32-baseline，只检查了推理精度的一致性；"
+                  "要确认混合精度训练没有损失准确率，请提供 fp32 训练的验证准确率")
+        elif args.fp32_baseline - fp32_accuracy > args.amp_tolerance:
+            # 准确率不达标的模型不能留在默认路径上被推理服务加载
+            rejected_path = "best_resnet50.amp_rejected.pth"
+            os.replace("best_resnet50.pth", rejected_path)
+            print(f"❌ 混合精度训练的验证准确率比 fp32 基线 {args.fp32_baseline:.2f}% 低 "
+                  f"{args.fp32_baseline - fp32_accuracy:.2f} 个百分点，超过 {args.amp_tolerance}；"
+                  f"模型已移至 {rejected_path}，请改用 fp32 训练")
+            writer.close()
+            sys.exit(1)
 
-    # 检查 Early Stopping 条件
-    if early_stopping.step(val_loss / len(val_loader)):
-        break  # 终止训练
+    # 关闭 TensorBoard writer
+    writer.close()
 
 
-# 关闭 TensorBoard writer
-writer.close()
+# Windows 下 DataLoader 子进程以 spawn 方式启动，会重新导入本文件，训练代码必须放在 main 中
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# 冻结骨干网络，只重新训练最后的线性分类层（model.fc）
+# 先用骨干网络把每个划分跑一遍，2048 维池化特征缓存为 float16 内存映射文件；之后训练/评估线性层只读缓存，几秒即可完成
+# 用法：
+#   提取特征：python train_head.py --extract --backbone imagenet --packed E:/wjx/py/mydata/plantvillage_packed
+#   训练线性层：python train_head.py --features E:/wjx/py/mydata/plantvillage_features --out head_resnet50.pth
+#   评估已有模型的线性层：python train_head.py --evaluate best_resnet50.pth
+#   在此基础上全量微调：python train.py --init head_resnet50.pth
+import argparse
+import os
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+import torchvision
+from torchvision import models
+from tqdm import tqdm
+
+from plantvillage.checkpoint import export_model, load_model_file
+from plantvillage.data import loader_config, make_loader
+from plantvillage.features import FEATURE_DIM, FeatureDataset, attach_head, extract_split
+from plantvillage.packed import PackedDataset
+from plantvillage.preprocess import TRANSFORM
+from plantvillage.shards import ShardDataset
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="在缓存的骨干网络特征上训练/评估线性分类层")
+    parser.add_argument("--features", default="E:/wjx/py/mydata/plantvillage_features", help="特征缓存目录")
+    # 提取特征
+    parser.add_argument("--extract", action="store_true", help="先用骨干网络提取各划分的特征")
+    parser.add_argument("--backbone", default="imagenet",
+                        help="提取特征用的骨干网络：imagenet（预训练权重）或训练好的模型文件路径")
+    parser.add_argument("--data", default="E:/wjx/py/mydata/plantvillage_splitted", help="ImageFolder 格式的数据集根目录")
+    parser.add_argument("--packed", default=None, help="pack_dataset.py 生成的打包目录")
+    parser.add_argument("--shards", default=None, help="imgdata_yolo2resnet50.py --format shards 生成的分片目录")
+    parser.add_argument("--splits", nargs="+", default=["train", "val", "test"])
+    parser.add_argument("--num-workers", type=int, default=None, help="提取特征时 DataLoader 子进程数")
+    # 训练线性层
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--weight-decay", type=float, default=1e-4)
+    parser.add_argument("--out", default="head_resnet50.pth", help="装上新线性层的完整模型保存路径")
+    # 只评估
+    parser.add_argument("--evaluate", default=None, help="只评估该模型的线性层（骨干须与特征缓存一致）")
+    return parser.parse_args()
+
+
+def load_backbone(source):
+    """imagenet 表示 torchvision 预训练权重，否则为 train.py / train_head.py 保存的完整模型"""
+    if source == "imagenet":
+        return models.resnet50(pretrained=True)
+    model, _ = load_model_file(source)
+    return model
+
+
+def open_split(args, split):
+    if args.packed:
+        return PackedDataset(args.packed, split)
+    if args.shards:
+        return ShardDataset(args.shards, split)
+    return torchvision.datasets.ImageFolder(root=os.path.join(args.data, split), transform=TRANSFORM)
+
+
+def extract(args, device):
+    model = load_backbone(args.backbone)
+    loader_cfg = loader_config(device, args.num_workers)
+    for split in args.splits:
+        dataset = open_split(args, split)
+        loader = make_loader(dataset, 64, False, loader_cfg)
+        bar = tqdm(desc=f"提取特征 {split}", unit="img")
+
+        def progress(done, total):
+            bar.total = total
+            bar.update(done - bar.n)
+
+        count = extract_split(model, loader, args.features, split, device,
+                              dataset.classes, dataset.class_to_idx, args.backbone, progress)
+        bar.close()
+        print(f"{split}: {count} 个样本的特征已写入 {args.features}")
+
+
+def evaluate(head, dataset, criterion, batch_size, device):
+    """返回 (平均损失, 准确率%)"""
+    head.eval()
+    correct = 0
+    running_loss = 0.0
+    with torch.no_grad():
+        for features, labels in dataset.batches(batch_size):
+            features, labels = features.to(device), labels.to(device)
+            outputs = head(features)
+            running_loss += criterion(outputs, labels).item() * labels.size(0)
+            correct += (outputs.argmax(1) == labels).sum().item()
+    return running_loss / len(dataset), 100 * correct / len(dataset)
+
+
+def train(args, device):
+    train_set = FeatureDataset(args.features, "train")
+    val_set = FeatureDataset(args.features, "val")
+    head = nn.Linear(FEATURE_DIM, len(train_set.classes)).to(device)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(head.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    generator = torch.Generator().manual_seed(42)
+
+    best_loss = float("inf")
+    best_state = None
+    for epoch in range(args.epochs):
+        head.train()
+        for features, labels in train_set.batches(args.batch_size, shuffle=True, generator=generator):
+            features, labels = features.to(device), labels.to(device)
+            optimizer.zero_grad()
+            loss = criterion(head(features), labels)
+            loss.backward()
+            optimizer.step()
+
+        val_loss, val_accuracy = evaluate(head, val_set, criterion, args.batch_size, device)
+        print(f"Epoch [{epoch + 1}/{args.epochs}], Validation Loss: {val_loss:.4f}, "
+              f"Validation Accuracy: {val_accuracy:.2f}%")
+        if val_loss < best_loss:
+            best_loss = val_loss
+            best_state = {k: v.detach().clone() for k, v in head.state_dict().items()}
+    head.load_state_dict(best_state)
+
+    if os.path.exists(os.path.join(args.features, "test.index.json")):
+        _, test_accuracy = evaluate(head, FeatureDataset(args.features, "test"), criterion, args.batch_size, device)
+        print(f"Test Accuracy: {test_accuracy:.2f}%")
+
+    # 装回提取特征时用的骨干网络，保存完整模型，可直接用于推理服务或 train.py --init 继续全量微调
+    model = attach_head(load_backbone(train_set.source), head.cpu())
+    export_model(model, train_set.class_to_idx, args.out)
+    print(f"模型已保存到 {args.out}")
+
+
+def main():
+    args = parse_args()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if args.extract:
+        extract(args, device)
+    if args.evaluate:
+        # 完整模型的 fc 层直接作用于缓存特征，前提是该模型的骨干就是提取特征所用的骨干
+        head = load_model_file(args.evaluate, device)[0].fc
+        criterion = nn.CrossEntropyLoss()
+        for split in args.splits:
+            if os.path.exists(os.path.join(args.features, f"{split}.index.json")):
+                loss, accuracy = evaluate(head, FeatureDataset(args.features, split), criterion, args.batch_size, device)
+                print(f"{split}: Loss: {loss:.4f}, Accuracy: {accuracy:.2f}%")
+    elif not args.extract or os.path.exists(os.path.join(args.features, "train.index.json")):
+        train(args, device)
+
+
+if __name__ == "__main__":
+    main()